@@ -1,4 +1,5 @@
 import configparser
+import os
 from pathlib import Path
 
 CONFIG = {}
@@ -30,6 +31,9 @@ def load_config():
     if not CONFIG:
         parser = configparser.ConfigParser()
         parser.read(ROOT_PATH / "config.ini")
+        # extra ini files (separated by os.pathsep) override single keys of config.ini, e.g. for benchmarks
+        overrides = os.environ.get("MIWI_CONFIG", "")
+        parser.read([path for path in overrides.split(os.pathsep) if path])
 
         for section in parser.sections():
             CONFIG[section] = {}
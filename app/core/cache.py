@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+from app.core.logger import get_logger
+from app.core.metrics import COLLECTORS
+
+CACHES: dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, maxsize: int = 0):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.items: dict[Hashable, tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        # writers can be database executor threads (e.g. the sql render cache), lookups need no lock
+        self.lock = threading.Lock()
+
+        CACHES[name] = self
+
+    def get(self, key: Hashable, default=None):
+        entry = self.items.get(key)
+        if entry and time.monotonic() < entry[0]:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value, ttl: float | None = None):
+        with self.lock:
+            if self.maxsize and len(self.items) >= self.maxsize and key not in self.items:
+                # drop the oldest entry
+                self.items.pop(next(iter(self.items)), None)
+
+            self.items[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def invalidate(self, key: Hashable | None = None):
+        with self.lock:
+            if key is None:
+                self.items.clear()
+            else:
+                self.items.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "name": self.name,
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class AsyncTTLCache(TTLCache):
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0, maxsize: int = 0):
+        super().__init__(name, ttl, maxsize)
+
+        # expired entries are still served for `stale_ttl` seconds while a reload runs in the background
+        self.stale_ttl = stale_ttl
+        self._loading: dict[Hashable, asyncio.Task] = {}
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], refresh=False):
+        entry = self.items.get(key)
+        if entry and not refresh:
+            now = time.monotonic()
+            if now < entry[0]:
+                self.hits += 1
+                return entry[1]
+
+            if now < entry[0] + self.stale_ttl:
+                self.hits += 1
+                self._load(key, loader)
+                return entry[1]
+
+        self.misses += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        # single flight: callers asking for the same key share one load
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run_loader(key, loader))
+            # background reloads may have nobody awaiting them, errors are already logged
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[key] = task
+
+        return task
+
+    async def _run_loader(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        except Exception as err:
+            get_logger().warning(f"{self.name} cache failed to load {key}: {err}")
+            raise
+        finally:
+            self._loading.pop(key, None)
+
+
+def collect_cache_metrics() -> list:
+    caches = [cache.stats() for cache in CACHES.values()]
+    metrics = [
+        ("cache_hits_total", "counter", "Cache lookups served from the cache", "hits"),
+        ("cache_misses_total", "counter", "Cache lookups that missed", "misses"),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups that hit", "hit_ratio"),
+        ("cache_size", "gauge", "Entries held by the cache", "size"),
+    ]
+
+    return [
+        (name, metric_type, help, [({"cache": stats["name"]}, stats[field]) for stats in caches])
+        for name, metric_type, help, field in metrics
+    ]
+
+
+COLLECTORS.append(collect_cache_metrics)
@@ -1,21 +1,233 @@
+import asyncio
+import contextvars
+import functools
 import json
 import re
-from datetime import datetime, date
+import threading
+import time
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
 import mariadb
 
 from app.config import get_config
+from app.core.cache import TTLCache
 from app.core.logger import get_logger
+from app.core.metrics import COLLECTORS, DB_QUERY_SECONDS
 from app.core.query import Query
+from app.schema.exceptions import DatabaseError
+
+CONNECTION_POOLS: dict[str, "DatabasePool"] = {}
+
+# the mariadb connector is blocking, statements run here instead of on the event loop
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(get_config("database.executor_workers", 10)), thread_name_prefix="database"
+)
+
+
+# {"count", "time"} of the statements run for the current request, set by QueryStatsMiddleware
+QUERY_STATS: contextvars.ContextVar[dict | None] = contextvars.ContextVar("query_stats", default=None)
+
+SLOW_QUERY_SECONDS = float(get_config("database.slow_query_ms", 200)) / 1000
+QUERY_BUDGET = int(get_config("database.query_budget", 20))
+
+# table => {column: type}, shared by every connection of the process
+TABLE_COLUMNS = TTLCache("table_columns", ttl=float(get_config("database.schema_cache_ttl", 3600)))
+
+
+class DatabasePool:
+    def __init__(self, config: dict):
+        self.host = config.get("host", "localhost")
+        self.port = int(config.get("port", 3306))
+        self.database = config.get("database", "")
+        self.user = config.get("username", "")
+        self.password = config.get("password", "")
+
+        self.name = f"pool_{self.database}"
+        self.size = int(config.get("pool_size", 10))
+        # unpooled connections allowed on top of the pool, beyond that callers wait up to `pool_timeout`
+        self.max_overflow = int(config.get("pool_max_overflow", 5))
+        self.timeout = float(config.get("pool_timeout", 10))
+        # connections kept apart from the request slots for short internal work (token refresh) done while the
+        # caller still holds its own connection, so a saturated pool can not deadlock on it
+        self.reserved = int(config.get("pool_reserved", 2))
+
+        self.pool = mariadb.ConnectionPool(
+            host=self.host,
+            database=self.database,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            autocommit=False,
+            pool_name=self.name,
+            pool_size=self.size,
+            pool_validation_interval=300,
+        )
+        self.slots: asyncio.Semaphore | None = None
+        self.reserved_slots: asyncio.Semaphore | None = None
+        self.lock = threading.Lock()
+
+        self.in_use = 0
+        self.overflow_in_use = 0
+        self.overflow_total = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def get_connection(self) -> tuple[mariadb.Connection, bool]:
+        try:
+            return self.pool.get_connection(), True
+        except mariadb.PoolError:
+            # pool exhausted, open an accounted overflow connection
+            conn = mariadb.connect(
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                user=self.user,
+                password=self.password,
+                autocommit=False,
+            )
+            with self.lock:
+                self.overflow_total += 1
+                self.overflow_in_use += 1
+
+            return conn, False
+
+    def return_connection(self, conn: mariadb.Connection, pooled: bool):
+        # closing a pooled connection hands it back to the pool
+        conn.close()
+        if not pooled:
+            with self.lock:
+                self.overflow_in_use -= 1
+
+    async def acquire(self, reserved=False) -> "Database":
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size + self.max_overflow)
+            self.reserved_slots = asyncio.Semaphore(max(self.reserved, 1))
+
+        slots = self.reserved_slots if reserved else self.slots
+        start = time.monotonic()
+        if slots.locked():
+            self.waits += 1
+
+        try:
+            await asyncio.wait_for(slots.acquire(), self.timeout)
+        except TimeoutError as err:
+            self.timeouts += 1
+            raise DatabaseError("Timed out waiting for a database connection", status=503) from err
+
+        self.wait_time += time.monotonic() - start
+        self.in_use += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            dbo = await loop.run_in_executor(DB_EXECUTOR, Database, self)
+        except BaseException:
+            self.release(reserved)
+            raise
+
+        dbo.reserved = reserved
+        return dbo
+
+    def release(self, reserved=False):
+        self.in_use -= 1
+        if reserved:
+            self.reserved_slots.release()
+        else:
+            self.slots.release()
+
+    def stats(self) -> dict:
+        pool_connections = getattr(self.pool, "connection_count", self.size)
+
+        return {
+            "name": self.name,
+            "size": self.size,
+            "max_overflow": self.max_overflow,
+            "in_use": self.in_use,
+            "idle": max(pool_connections - (self.in_use - self.overflow_in_use), 0),
+            "overflow_in_use": self.overflow_in_use,
+            "overflow_total": self.overflow_total,
+            "waits": self.waits,
+            "wait_time": round(self.wait_time, 4),
+            "timeouts": self.timeouts,
+        }
+
+
+def escape_like(value: str) -> str:
+    # literal match for a value used inside a LIKE pattern
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def normalize_sql(sql: str) -> str:
+    # literals replaced by ?, whitespace collapsed, so the same statement logs the same way
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+
+    return " ".join(sql.split())
+
+
+def observe_query(sql: str, elapsed: float):
+    DB_QUERY_SECONDS.observe(elapsed, statement_type(sql))
+
+    stats = QUERY_STATS.get()
+    if stats is not None:
+        stats["count"] += 1
+        stats["time"] += elapsed
+
+    if elapsed >= SLOW_QUERY_SECONDS:
+        get_logger().warning(f"Slow query ({elapsed * 1000:.1f} ms): {normalize_sql(sql)}")
+
+
+def statement_type(sql: str) -> str:
+    # first keyword of the statement, e.g. select / insert / update
+    words = sql.lstrip("( \n").split(None, 1)
+    return words[0].lower() if words else ""
+
+
+def collect_pool_metrics() -> list:
+    pools = [pool.stats() for pool in CONNECTION_POOLS.values()]
+    metrics = [
+        ("db_pool_in_use", "gauge", "Connections checked out of the pool", "in_use"),
+        ("db_pool_idle", "gauge", "Idle connections in the pool", "idle"),
+        ("db_pool_overflow_in_use", "gauge", "Overflow connections checked out", "overflow_in_use"),
+        ("db_pool_waits_total", "counter", "Acquires that had to wait for a connection", "waits"),
+        ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection", "wait_time"),
+        ("db_pool_timeouts_total", "counter", "Acquires that timed out", "timeouts"),
+    ]
+
+    return [
+        (name, metric_type, help, [({"pool": stats["name"]}, stats[field]) for stats in pools])
+        for name, metric_type, help, field in metrics
+    ]
+
+
+COLLECTORS.append(collect_pool_metrics)
+
+
+def invalidate_table_columns(table: str | None = None):
+    TABLE_COLUMNS.invalidate(table)
 
-CONNECTION_POOLS = {}
+
+def get_pool() -> DatabasePool:
+    config = get_config("database", {})
+    pool_name = f"pool_{config.get('database', '')}"
+
+    if pool_name not in CONNECTION_POOLS:
+        CONNECTION_POOLS[pool_name] = DatabasePool(config)
+
+    return CONNECTION_POOLS[pool_name]
 
 
 class Database:
-    def __init__(self):
+    def __init__(self, pool: DatabasePool | None = None):
         self.config = get_config("database", {})
+        self.pool = pool or get_pool()
         self.conn: mariadb.Connection | None = None
         self.csr: mariadb.cursors.Cursor | None = None
+        self.pooled = False
+        # holds one of the pool's reserved slots, see DatabasePool.reserved
+        self.reserved = False
 
         self.logger = get_logger()
         self.connect()
@@ -23,54 +235,36 @@ class Database:
         self.query = None
 
     def connect(self):
-        dbhost = self.config.get("host", "localhost")
-        dbport = int(self.config.get("port", 3306))
-        dbname = self.config.get("database", "")
-        dbuser = self.config.get("username", "")
-        dbpass = self.config.get("password", "")
-
-        pool_name = f"pool_{dbname}"
-        pool_size = self.config.get("pool_size", 10)
-
-        if pool_name not in CONNECTION_POOLS:
-            CONNECTION_POOLS[pool_name] = mariadb.ConnectionPool(
-                host=dbhost,
-                database=dbname,
-                port=dbport,
-                user=dbuser,
-                password=dbpass,
-                autocommit=False,
-                pool_name=pool_name,
-                pool_size=pool_size,
-                pool_validation_interval=300,
-            )
-
-        pool = CONNECTION_POOLS[pool_name]
-
-        try:
-            conn = pool.get_connection()
-        except:
-            # no connection in pool available
-            conn = mariadb.connect(host=dbhost, database=dbname, user=dbuser, password=dbpass, autocommit=False)
+        conn, self.pooled = self.pool.get_connection()
 
         # conn.character_set = 'utf8mb4'
 
         self.conn = conn
         if conn:
-            self.csr = self.conn.cursor()
+            # the binary protocol executes statements server side as prepared statements, re-running the same
+            # statement on the cursor reuses it
+            self.csr = self.conn.cursor(binary=int(self.config.get("binary_protocol", 0)) == 1)
         else:
-            self.logger.error(f"failed to connect to {dbhost} - {dbname}")
-            raise mariadb.DatabaseError(f"failed to connect to database")
+            self.logger.error(f"failed to connect to {self.pool.host} - {self.pool.database}")
+            raise mariadb.DatabaseError("failed to connect to database")
 
     def execute(self, sql: str | Query, *params):
         if isinstance(sql, Query):
+            params = (*sql.params, *params)
             sql = str(sql)
 
-        self.csr.execute(sql, params)
+        start = time.perf_counter()
+        try:
+            self.csr.execute(sql, params)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
 
     def commit(self):
         self.conn.commit()
 
+    def rollback(self):
+        self.conn.rollback()
+
     def get_num_rows(self):
         return self.csr.rowcount
 
@@ -80,15 +274,53 @@ class Database:
     def get_last_insert_id(self):
         return int(self.csr.lastrowid) if self.csr.lastrowid else 0
 
-    def get_table_columns(self, table):
-        self.execute("SHOW FULL COLUMNS FROM %s" % table)
-        fields = self.fetch_all()
+    def get_table_columns(self, table) -> dict[str, str]:
+        columns = TABLE_COLUMNS.get(table)
+        if columns is None:
+            self.execute("SHOW FULL COLUMNS FROM `%s`" % table)
+            fields = self.fetch_all()
+
+            columns = {}
+            for field in fields:
+                columns[field["Field"]] = re.sub(r"[(0-9)]", "", field["Type"])
+
+            TABLE_COLUMNS.set(table, columns)
+
+        return columns
+
+    def warm_schema_cache(self, tables: list[str]):
+        for table in tables:
+            TABLE_COLUMNS.invalidate(table)
+            self.get_table_columns(table)
+
+    def convert_value(self, value, column_type: str = ""):
+        if value is None:
+            return None
+
+        if isinstance(value, (list, dict, tuple)):
+            return json.dumps(value, default=str)
+
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m-%d" if column_type == "date" else "%Y-%m-%d %H:%M:%S")
 
-        result = {}
-        for field in fields:
-            result[field["Field"]] = re.sub(r"[(0-9)]", "", field["Type"])
+        if isinstance(value, date):
+            return value.strftime("%Y-%m-%d")
 
-        return result
+        # is Enum
+        if hasattr(value, "value"):
+            value = value.value
+
+        if isinstance(value, bool):
+            return 1 if value else 0
+
+        # iso strings (e.g. datetime.isoformat()) into the mysql datetime format
+        if isinstance(value, str) and column_type in ("datetime", "timestamp") and "T" in value:
+            try:
+                return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                return value
+
+        return value
 
     def fetch_all(self):
         results = []
@@ -124,43 +356,29 @@ class Database:
         return None
 
     def insert_object(self, table, item, replace=False):
+        columns = self.get_table_columns(table)
+
         fields = []
         values = []
 
         for k, v in item.items():
-            if v is None:
+            if k not in columns or k.startswith("_"):
                 continue
 
-            if isinstance(v, (list, dict, tuple)):
-                v = json.dumps(v, default=str)
-
-            if isinstance(v, datetime):
-                v = v.strftime("%Y-%m-%d %H:%M:%S")
-
-            if isinstance(v, date):
-                v = v.strftime("%Y-%m-%d")
-
-            # is Enum
-            if hasattr(v, "value"):
-                v = v.value
-
-            if isinstance(v, bool):
-                v = 1 if v else 0
-
-            if k.startswith("_"):
+            v = self.convert_value(v, columns[k])
+            if v is None:
                 continue
 
             fields.append("`" + k + "`")
-            values.append(self.q(v))
+            values.append(v)
 
         cmd = "REPLACE" if replace else "INSERT"
-        insert_sql = cmd + " INTO %s(%s) VALUES (%s)" % (table, ", ".join(fields), ", ".join(values))
-
-        query = Query()
-        query.Insert(table).Columns(fields).Values(", ".join(values))
+        insert_sql = cmd + " INTO %s(%s) VALUES (%s)" % (table, ", ".join(fields), ", ".join(["?"] * len(values)))
 
         try:
-            self.csr.execute(insert_sql)
+            started = time.perf_counter()
+            self.csr.execute(insert_sql, values)
+            observe_query(insert_sql, time.perf_counter() - started)
         except mariadb.DatabaseError as err:
             self.logger.error("%s: %s" % (table, str(err)))
             self.conn.rollback()
@@ -174,48 +392,32 @@ class Database:
 
         statement = "UPDATE %s SET %s WHERE %s"
         wheres = []
+        where_values = []
         fields = []
+        values = []
 
         if isinstance(key, str):
             key = [key]
 
         for k, v in item.items():
-            if k not in columns.keys():
-                continue
-
-            if k.startswith("_"):
+            if k not in columns or k.startswith("_"):
                 continue
 
-            if isinstance(v, (list, dict, tuple)):
-                v = json.dumps(v, default=str)
-
-            if isinstance(v, datetime):
-                v = v.strftime("%Y-%m-%d %H:%M:%S")
-
-            if isinstance(v, date):
-                v = v.strftime("%Y-%m-%d")
-
-            # is Enum
-            if hasattr(v, "value"):
-                v = v.value
-
-            if isinstance(v, bool):
-                v = 1 if v else 0
+            v = self.convert_value(v, columns[k])
 
             if k in key:
-                wheres.append(f"`{k}` = " + ("IS NULL" if v is None else self.q(v)))
-                continue
-
-            if v is None:
-                if update_none:
-                    val = "NULL"
+                if v is None:
+                    wheres.append(f"`{k}` IS NULL")
                 else:
-                    continue
+                    wheres.append(f"`{k}` = ?")
+                    where_values.append(v)
+                continue
 
-            else:
-                val = self.q(v)
+            if v is None and not update_none:
+                continue
 
-            fields.append(f"`{k}` = {val}")
+            fields.append(f"`{k}` = ?")
+            values.append(v)
 
         if not fields:
             return True
@@ -223,7 +425,9 @@ class Database:
         sql = statement % (table, ", ".join(fields), " AND ".join(wheres))
 
         try:
-            self.csr.execute(sql)
+            started = time.perf_counter()
+            self.csr.execute(sql, values + where_values)
+            observe_query(sql, time.perf_counter() - started)
         except mariadb.DatabaseError as err:
             self.logger.error("%s: %s" % (table, str(err)))
             self.conn.rollback()
@@ -232,6 +436,88 @@ class Database:
             self.conn.commit()
             return True
 
+    def bulk_upsert(
+        self,
+        table: str,
+        rows: list[dict],
+        key_columns: list[str] | str,
+        update_columns: list[str] | None = None,
+        chunk_size: int | None = None,
+        commit=True,
+    ) -> int:
+        if not rows:
+            return 0
+
+        if isinstance(key_columns, str):
+            key_columns = [key_columns]
+
+        fields = self.get_row_fields(table, rows[0])
+        for key in key_columns:
+            if key not in fields:
+                raise ValueError(f"Key column '{key}' is missing from the {table} rows.")
+
+        if update_columns is None:
+            update_columns = [field for field in fields if field not in key_columns]
+
+        updates = [f"`{field}` = VALUES(`{field}`)" for field in update_columns if field in fields]
+        if not updates:
+            updates = [f"`{key_columns[0]}` = `{key_columns[0]}`"]
+
+        columns = ", ".join(f"`{field}`" for field in fields)
+        statement = f"INSERT INTO `{table}` ({columns}) VALUES %s ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+
+        return self.write_rows(statement, table, fields, rows, chunk_size, commit)
+
+    def bulk_replace(self, table: str, rows: list[dict], chunk_size: int | None = None, commit=True) -> int:
+        if not rows:
+            return 0
+
+        fields = self.get_row_fields(table, rows[0])
+        columns = ", ".join(f"`{field}`" for field in fields)
+        statement = f"REPLACE INTO `{table}` ({columns}) VALUES %s"
+
+        return self.write_rows(statement, table, fields, rows, chunk_size, commit)
+
+    def get_row_fields(self, table: str, row: dict) -> list[str]:
+        # every row of a bulk write uses the columns of the first one
+        columns = self.get_table_columns(table)
+        return [k for k in row if k in columns and not k.startswith("_")]
+
+    def write_rows(
+        self, statement: str, table: str, fields: list[str], rows: list[dict], chunk_size: int | None, commit: bool
+    ) -> int:
+        columns = self.get_table_columns(table)
+        values = [tuple(self.convert_value(row.get(field), columns[field]) for field in fields) for row in rows]
+
+        placeholders = "(" + ", ".join(["?"] * len(fields)) + ")"
+        chunk_size = chunk_size or int(self.config.get("bulk_chunk_size", 1000))
+        # executemany goes through the connector's bulk (array binding) protocol
+        use_executemany = self.config.get("bulk_method", "executemany") == "executemany"
+
+        affected = 0
+        try:
+            for start in range(0, len(values), chunk_size):
+                chunk = values[start : start + chunk_size]
+                started = time.perf_counter()
+                if use_executemany:
+                    sql = statement % placeholders
+                    self.csr.executemany(sql, chunk)
+                else:
+                    sql = statement % ", ".join([placeholders] * len(chunk))
+                    self.csr.execute(sql, [value for row in chunk for value in row])
+                observe_query(sql, time.perf_counter() - started)
+
+                affected += max(self.csr.rowcount, 0)
+        except mariadb.DatabaseError as err:
+            self.logger.error(f"{table}: {err}")
+            self.conn.rollback()
+            raise err
+
+        if commit:
+            self.conn.commit()
+
+        return affected
+
     def q(self, content: any) -> str | list:
         if isinstance(content, list):
             return [self.csr._connection.escape_string(text) for text in content]
@@ -246,13 +532,167 @@ class Database:
             if self.csr:
                 self.csr.close()
             if self.conn:
-                self.conn.close()
+                self.pool.return_connection(self.conn, self.pooled)
         except mariadb.ProgrammingError as err:
             self.logger.debug(str(err))
+        finally:
+            self.csr = None
+            self.conn = None
 
     def __del__(self):
         self.close()
 
 
-def get_dbo() -> Database:
-    return Database()
+class AsyncDatabase:
+    def __init__(self, dbo: Database):
+        self.dbo = dbo
+        # a connection runs one statement at a time, coroutines sharing it queue here
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, reserved=False) -> "AsyncDatabase":
+        return cls(await get_pool().acquire(reserved))
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # the executor thread sees the request's context, so its statements count for the request
+        context = contextvars.copy_context()
+        async with self.lock:
+            future = loop.run_in_executor(DB_EXECUTOR, context.run, functools.partial(func, *args, **kwargs))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the statement keeps running in its thread, the connection stays locked until it is done
+                await asyncio.wait([future])
+                raise
+
+    def _execute_fetch(self, fetch, sql: str | Query | None, params: tuple, *args):
+        if sql is not None:
+            self.dbo.execute(sql, *params)
+
+        return fetch(*args)
+
+    async def execute(self, sql: str | Query, *params):
+        return await self.run(self.dbo.execute, sql, *params)
+
+    async def fetch_all(self, sql: str | Query | None = None, *params) -> list[dict]:
+        return await self.run(self._execute_fetch, self.dbo.fetch_all, sql, params)
+
+    async def fetch_one(self, sql: str | Query | None = None, *params) -> dict | None:
+        return await self.run(self._execute_fetch, self.dbo.fetch_one, sql, params)
+
+    async def fetch_column(self, field: str, sql: str | Query | None = None, *params) -> list:
+        return await self.run(self._execute_fetch, self.dbo.fetch_column, sql, params, field)
+
+    async def fetch_result(self, sql: str | Query | None = None, *params):
+        return await self.run(self._execute_fetch, self.dbo.fetch_result, sql, params)
+
+    async def commit(self):
+        return await self.run(self.dbo.commit)
+
+    async def rollback(self):
+        return await self.run(self.dbo.rollback)
+
+    async def get_table_columns(self, table) -> dict[str, str]:
+        return await self.run(self.dbo.get_table_columns, table)
+
+    async def warm_schema_cache(self, tables: list[str]):
+        return await self.run(self.dbo.warm_schema_cache, tables)
+
+    async def insert_object(self, table, item, replace=False) -> int:
+        return await self.run(self.dbo.insert_object, table, item, replace)
+
+    async def update_object(self, table, item: dict, key: list[str] | str, update_none=False) -> bool:
+        return await self.run(self.dbo.update_object, table, item, key, update_none)
+
+    async def bulk_upsert(
+        self,
+        table: str,
+        rows: list[dict],
+        key_columns: list[str] | str,
+        update_columns: list[str] | None = None,
+        chunk_size: int | None = None,
+        commit=True,
+    ) -> int:
+        return await self.run(self.dbo.bulk_upsert, table, rows, key_columns, update_columns, chunk_size, commit)
+
+    async def bulk_replace(self, table: str, rows: list[dict], chunk_size: int | None = None, commit=True) -> int:
+        return await self.run(self.dbo.bulk_replace, table, rows, chunk_size, commit)
+
+    def get_num_rows(self) -> int:
+        return self.dbo.get_num_rows()
+
+    def get_affected_rows(self) -> int:
+        return self.dbo.get_affected_rows()
+
+    def get_last_insert_id(self) -> int:
+        return self.dbo.get_last_insert_id()
+
+    def q(self, content: any) -> str | list:
+        return self.dbo.q(content)
+
+    async def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            await self.run(self.dbo.close)
+        finally:
+            self.dbo.pool.release(self.dbo.reserved)
+
+
+async def warm_schema_cache():
+    tables = [table.strip() for table in get_config("database.warm_tables", "").split(",") if table.strip()]
+    if not tables:
+        return
+
+    try:
+        dbo = await AsyncDatabase.connect()
+        try:
+            await dbo.warm_schema_cache(tables)
+        finally:
+            await dbo.close()
+    except Exception as err:
+        get_logger().warning(f"Failed to warm up the table schema cache: {err}")
+
+
+async def get_dbo() -> AsyncIterator[AsyncDatabase]:
+    dbo = await AsyncDatabase.connect()
+    try:
+        yield dbo
+    finally:
+        await dbo.close()
+
+
+class QueryStatsMiddleware:
+    # counts the statements of each request, reports them in debug mode and flags requests over the budget
+    def __init__(self, app):
+        self.app = app
+        self.debug = int(get_config("server.debug", 0)) == 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = {"count": 0, "time": 0.0}
+        token = QUERY_STATS.set(stats)
+
+        async def send_wrapper(message):
+            if self.debug and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats["count"]).encode()))
+                headers.append((b"x-db-time", f"{stats['time'] * 1000:.1f}ms".encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            QUERY_STATS.reset(token)
+            if QUERY_BUDGET and stats["count"] > QUERY_BUDGET:
+                get_logger().warning(
+                    f"{scope['method']} {scope['path']} ran {stats['count']} queries "
+                    f"({stats['time'] * 1000:.1f} ms), over the budget of {QUERY_BUDGET}"
+                )
@@ -0,0 +1,78 @@
+import importlib.util
+
+import httpx
+
+from app.config import get_config
+from app.core.logger import get_logger
+
+HTTP_CLIENT: httpx.AsyncClient | None = None
+
+# default read timeouts (seconds) for the Miwi open api routes, override with `timeout_<route>` in [miwitracker]
+ROUTE_TIMEOUTS = {
+    "get_token": 10.0,
+    "sendcommand": 15.0,
+}
+
+
+def get_route_name(uri: str) -> str:
+    return uri.rstrip("/").rsplit("/", 1)[-1].lower()
+
+
+def get_route_timeout(uri: str) -> float:
+    route = get_route_name(uri)
+    default = ROUTE_TIMEOUTS.get(route, get_config("miwitracker.timeout", 30))
+
+    return float(get_config(f"miwitracker.timeout_{route}", default))
+
+
+def get_timeout(uri: str, read: float | None = None) -> httpx.Timeout:
+    # a dead upstream fails on connect within seconds, a slow one still gets the full read timeout
+    connect = float(get_config("miwitracker.connect_timeout", 3))
+
+    return httpx.Timeout(read or get_route_timeout(uri), connect=connect, pool=connect)
+
+
+def create_client() -> httpx.AsyncClient:
+    miwi_config = get_config("miwitracker", {})
+
+    limits = httpx.Limits(
+        max_connections=int(miwi_config.get("max_connections", 100)),
+        max_keepalive_connections=int(miwi_config.get("max_keepalive_connections", 20)),
+        keepalive_expiry=float(miwi_config.get("keepalive_expiry", 30)),
+    )
+
+    # http2 needs the optional `h2` package
+    http2 = int(miwi_config.get("http2", 1)) == 1 and importlib.util.find_spec("h2") is not None
+
+    return httpx.AsyncClient(
+        base_url=miwi_config.get("api_endpoint", ""),
+        headers={"Content-Type": "application/json"},
+        limits=limits,
+        http2=http2,
+        timeout=float(miwi_config.get("timeout", 30)),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    global HTTP_CLIENT
+
+    # created lazily when used outside of the app lifespan (e.g. scripts)
+    if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+        HTTP_CLIENT = create_client()
+
+    return HTTP_CLIENT
+
+
+async def open_client() -> httpx.AsyncClient:
+    client = get_client()
+    get_logger().info("Miwi http client ready")
+
+    return client
+
+
+async def close_client():
+    global HTTP_CLIENT
+
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from app.config import get_config
+from app.core.http import get_route_name
+
+# route name => limiter, created on first use
+LIMITERS: dict[str, "EndpointLimiter"] = {}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+
+        # waiting callers queue on the lock and get their tokens in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+
+class AdaptiveLimiter:
+    def __init__(self, limit: int, min_limit: int, max_limit: int, latency_target: float, backoff: float = 0.5):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, overloaded: bool):
+        async with self._condition:
+            self.in_flight -= 1
+
+            now = time.monotonic()
+            if overloaded or latency > self.latency_target:
+                # calls in flight together saw the same congestion, cut once per round trip
+                if now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                # additive increase, about one more slot per window of successful calls
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+
+class LimiterSlot:
+    __slots__ = ("overloaded",)
+
+    def __init__(self):
+        self.overloaded = False
+
+    def check(self, response: httpx.Response):
+        # throttling and upstream errors, Miwi level error codes are answers and not overload
+        if response.status_code == 429 or response.status_code >= 500:
+            self.overloaded = True
+
+
+class EndpointLimiter:
+    def __init__(self, route: str):
+        miwi_config = get_config("miwitracker", {})
+
+        def option(name: str, default):
+            return miwi_config.get(f"{name}_{route}", miwi_config.get(name, default))
+
+        self.route = route
+        self.bucket = TokenBucket(float(option("rate", 20)), int(option("burst", 40)))
+        self.concurrency = AdaptiveLimiter(
+            int(option("concurrency", 10)),
+            int(option("min_concurrency", 1)),
+            int(option("max_concurrency", 50)),
+            float(option("latency_target", 2)),
+        )
+
+        self.calls = 0
+        self.overloads = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.bucket.acquire()
+        await self.concurrency.acquire()
+
+        slot = LimiterSlot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except (httpx.TimeoutException, httpx.TransportError):
+            slot.overloaded = True
+            raise
+        finally:
+            self.calls += 1
+            self.overloads += int(slot.overloaded)
+            await self.concurrency.release(time.monotonic() - start, slot.overloaded)
+
+    def stats(self) -> dict:
+        return {
+            "route": self.route,
+            "rate": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "rate_waited": round(self.bucket.waited, 3),
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "decreases": self.concurrency.decreases,
+            "calls": self.calls,
+            "overloads": self.overloads,
+        }
+
+
+def get_limiter(uri: str) -> EndpointLimiter:
+    route = get_route_name(uri)
+    if route not in LIMITERS:
+        LIMITERS[route] = EndpointLimiter(route)
+
+    return LIMITERS[route]
@@ -1,33 +1,126 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
 
-from app.config import ROOT_PATH
+from app.config import LOG_PATH, get_config
+
+# logger name => listener writing its records on a background thread
+LISTENERS: dict[str, logging.handlers.QueueListener] = {}
+
+# attributes every LogRecord has, anything else was passed through `extra`
+RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in RECORD_FIELDS:
+                data[key] = value
+
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only resolve the message on the calling thread, formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
 
 
 def get_logger(name="app") -> logging.Logger:
     logger = logging.getLogger(name)
-    if not logger.hasHandlers():
+    if name not in LISTENERS:
         create_logger(name)
 
     return logger
 
 
-def create_logger(name="app", log_level=logging.INFO) -> logging.Logger:
+def create_file_handler(name: str, log_config: dict) -> logging.Handler:
+    logfile = LOG_PATH / f"{name}.log"
+    if not logfile.parent.exists():
+        logfile.parent.mkdir(parents=True, exist_ok=True)
+
+    backup_count = int(log_config.get("backup_count", 14))
+    if log_config.get("rotation", "time") == "size":
+        return logging.handlers.RotatingFileHandler(
+            logfile,
+            maxBytes=int(log_config.get("max_bytes", 10 * 1024 * 1024)),
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+
+    return logging.handlers.TimedRotatingFileHandler(
+        logfile, when=log_config.get("when", "midnight"), backupCount=backup_count, encoding="utf-8"
+    )
+
+
+def create_logger(name="app", log_level=None) -> logging.Logger:
     logger = logging.getLogger(name)
-    if not logger.hasHandlers():
+    if name in LISTENERS:
+        return logger
+
+    log_config = get_config("logging", {})
+    log_level = log_level or logging.getLevelName(log_config.get("level", "INFO").upper())
+
+    if log_config.get("format", "json") == "json":
+        formatter = JsonFormatter()
+    else:
         formatter = logging.Formatter("%(asctime)s\t%(levelname)s\t%(message)s")
 
-        logging.basicConfig(level=log_level)
-        logfile = ROOT_PATH / "logs" / f"{name}.log"
-        if not logfile.parent.exists():
-            logfile.parent.mkdir(parents=True, exist_ok=True)
-        if not logfile.exists():
-            logfile.touch()
-        fh = logging.FileHandler(logfile, encoding="utf-8")
+    handlers = [create_file_handler(name, log_config)]
+    if int(log_config.get("console", 1)) == 1:
+        handlers.append(logging.StreamHandler(sys.stderr))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
 
-        fh.setLevel(log_level)
-        logger.setLevel(log_level)
+    # the calling thread only enqueues, file and console io run on the listener thread
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    LISTENERS[name] = listener
 
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
+    # records below the level are dropped by the logger before a record is even created
+    logger.setLevel(log_level)
+    logger.addHandler(LocalQueueHandler(log_queue))
+    logger.propagate = False
 
     return logger
+
+
+def stop_logging():
+    # flushes the queued records, a later get_logger sets the pipeline up again
+    for name, listener in LISTENERS.items():
+        listener.stop()
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, LocalQueueHandler):
+                logger.removeHandler(handler)
+
+    LISTENERS.clear()
+
+
+atexit.register(stop_logging)
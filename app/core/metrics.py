@@ -0,0 +1,140 @@
+import bisect
+import time
+from collections.abc import Callable
+
+# name => metric, rendered in registration order
+METRICS: dict[str, "Counter | Histogram"] = {}
+# callables producing (name, type, help, [(labels, value)]) at scrape time, for state owned elsewhere
+COLLECTORS: list[Callable[[], list[tuple[str, str, str, list[tuple[dict, float]]]]]] = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+
+    pairs = []
+    for name, value in zip(names, values, strict=True):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+        METRICS[name] = self
+
+    def inc(self, *label_values, amount: float = 1):
+        # no lock, under the gil a racing increment can at worst be lost
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self.values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values => [count per bucket (last one is +Inf), sum]
+        self.series: dict[tuple, list] = {}
+
+        METRICS[name] = self
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series.setdefault(label_values, [[0] * (len(self.buckets) + 1), 0.0])
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), list(counts), strict=True):
+                cumulative += count
+                labels = format_labels((*self.labels, "le"), (*label_values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in list(METRICS.values()):
+        lines += metric.render()
+
+    for collect in COLLECTORS:
+        for name, metric_type, help, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {metric_type}"]
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of the api requests", ("method", "route", "status")
+)
+MIWI_CALL_SECONDS = Histogram(
+    "miwi_call_duration_seconds", "Latency of the Miwi open api calls", ("uri", "command", "outcome")
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Latency of the database statements", ("statement",), buckets=DB_BUCKETS
+)
+MIWI_COMMANDS = Counter(
+    "miwi_commands_total", "Setting commands sent to Miwi or skipped as already applied", ("result",)
+)
+OUTBOX_COMMANDS = Counter(
+    "outbox_commands_total", "Command outbox rows by event (enqueued, sent, retried, held, failed)", ("event",)
+)
+
+
+class MetricsMiddleware:
+    # plain asgi middleware, cheaper than BaseHTTPMiddleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the route template keeps the label set small, unmatched paths share one label
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], path, status)
@@ -1,73 +1,105 @@
+import asyncio
 import profile
-import hashlib
-import json
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 
 import httpx
 from fastapi import HTTPException
 
 from app.config import get_config
+from app.core.cache import AsyncTTLCache
+from app.core.http import get_route_name
+from app.core.metrics import MIWI_CALL_SECONDS, MIWI_COMMANDS
+from app.core.outbox import get_outbox
 from app.core.query import Query
+from app.core.resilience import send_request
+from app.core.tokens import get_token_manager
+from app.models.command_states import CommandStates, command_fingerprint
 from app.models.devices import Devices
 from app.models.projects import Projects
 from app.models.settings import Settings
+from app.schema.exceptions import NotFoundError
+from app.schema.settings import CommandProfile
+
+# device list snapshots indexed by imei, keyed by (user id, miwi group id)
+DEVICE_STATUS = AsyncTTLCache(
+    "device_status",
+    ttl=float(get_config("miwitracker.device_status_ttl", 15)),
+    stale_ttl=float(get_config("miwitracker.device_status_stale_ttl", 30)),
+)
+
+# bulk command name (as used by the /task routes) => Miwi method
+BULK_COMMANDS = {
+    "locate": "locate",
+    "setphonebook": "set_phone_book",
+    "setblockphone": "set_block_phone",
+    "setsos": "set_sos",
+    "sethealth": "set_health",
+    "setcallcenter": "set_call_center",
+    "reboot": "reboot",
+    "poweroff": "power_off",
+    "setfallalert": "set_fall_alert",
+    "offfallalert": "off_fall_alert",
+}
+
+# commands that only make sense while the device is online, they are never queued
+LIVE_COMMANDS = {"locate", "reboot", "poweroff"}
+LIVE_COMMAND_CODES = {"0039", "0010", "0048"}
+
+# commands with side effects beyond a setting, never repeated by the retry policy
+ONE_SHOT_COMMAND_CODES = {"0010", "0048"}
+
+# read-only api routes, retried on timeouts and upstream errors
+IDEMPOTENT_ROUTES = {"get_devicelist", "getdevicelistbygroup", "getorgangroupsinfolist"}
+
+# a rejected access token, as the http status or the Code of the answer
+AUTH_FAILURE_CODES = {401, 403}
+
+# bulk commands sent from the project's compiled command profile
+PROFILE_COMMANDS = {"setphonebook", "setsos", "setcallcenter", "setfallalert"}
+
+
+def is_auth_failure(r: httpx.Response) -> bool:
+    if r.status_code in AUTH_FAILURE_CODES:
+        return True
 
+    try:
+        response = r.json()
+    except ValueError:
+        return False
 
-class Miwi:
-    def __init__(self, dbo):
-        self.dbo = dbo
-
-        miwi_config = get_config("miwitracker")
-        self.app_id = miwi_config.get("app_id", "")
-        self.app_key = miwi_config.get("app_key", "")
-        self.api_endpoint = miwi_config.get("api_endpoint", "")
-        self.user_id = miwi_config.get("user_id", "")
-
-        self.access_token = ""
-        self.load_token()
-
-    def load_token(self):
-        query = Query()
-        query.Select("*").From("caches").Where("`key` = 'miwi.access_token'")
-        self.dbo.execute(query)
-        record = self.dbo.fetch_one()
+    return isinstance(response, dict) and response.get("Code") in AUTH_FAILURE_CODES
 
-        # treat as expire if last_updated is more than 2 weeks
-        if record:
-            last_updated = record["last_updated"]
-            if last_updated < datetime.now() - timedelta(weeks=2):
-                record = None
-            else:
-                self.access_token = str(record["value"])
-
-        if not record:
-            self.access_token = self.fetch_token()
-            insert_data = {
-                "key": "miwi.access_token",
-                "value": self.access_token,
-                "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            self.dbo.insert_object("caches", insert_data, True)
 
-    def fetch_token(self):
-        timestamp = int(datetime.now().timestamp())
-        password = self.app_key + str(self.app_id) + str(timestamp)
-        password_md5 = hashlib.md5(password.encode()).hexdigest()
+def call_outcome(response: dict) -> str:
+    code = response.get("Code", response.get("State"))
+    if code == 0:
+        return "ok"
+    if code == 1800:
+        return "offline"
 
-        r = httpx.post(
-            f"{self.api_endpoint}/api/token/get_token",
-            headers={"Content-Type": "application/json"},
-            json={"AppId": self.app_id, "Password": password_md5, "Timestamp": timestamp},
-        )
+    return f"code_{code}"
 
-        response = r.json()
-        if response:
-            if response["Code"] == 0:
-                return response["Result"]["AccessToken"]
 
-            raise HTTPException(status_code=400, detail=response["Message"])
+class Miwi:
+    def __init__(self, dbo, force=False):
+        self.dbo = dbo
 
-        raise HTTPException(status_code=400, detail="Failed to fetch token")
+        miwi_config = get_config("miwitracker")
+        self.api_endpoint = miwi_config.get("api_endpoint", "")
+        self.user_id = miwi_config.get("user_id", "")
+        self.tokens = get_token_manager()
+        self.outbox = get_outbox()
+        # imei => outbox ids of the commands held for the device during this request
+        self.queued: dict[str, list[int]] = {}
+
+        # setting commands the device already accepted with the same value are skipped, unless forced
+        self.track_applied = int(miwi_config.get("skip_unchanged", 0)) == 1
+        self.force = force
+        self.fingerprints: dict[tuple[str, str], str] = {}
+        self.fingerprints_loaded: set[str] = set()
+        # imei => command codes skipped during this request
+        self.skipped: dict[str, list[str]] = {}
 
     async def get_devices(self, miwi_group_id=None):
         # headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"}
@@ -84,33 +116,50 @@ class Miwi:
 
         raise HTTPException(status_code=400, detail="Failed to fetch devices")
 
-    async def check_onlines(self, imeis: list[str] | None = None, miwi_group_id=None) -> bool:
-        devices = await self.get_devices(miwi_group_id)
-        online_devices = list(filter(lambda x: x["Status"] == 1 and x["Imei"] in imeis, devices))
+    async def get_device_status(self, miwi_group_id=None, refresh=False) -> dict[str, dict]:
+        async def load():
+            return {device["Imei"]: device for device in await self.get_devices(miwi_group_id)}
+
+        return await DEVICE_STATUS.get_or_load((self.user_id, miwi_group_id), load, refresh)
+
+    async def check_onlines(self, imeis: list[str] | None = None, miwi_group_id=None, refresh=False) -> dict:
+        devices = await self.get_device_status(miwi_group_id, refresh)
         results = dict.fromkeys(imeis or [], False)
 
-        for device in online_devices:
-            if device["Imei"] in results:
-                results[device["Imei"]] = True
+        for imei in results:
+            device = devices.get(imei)
+            if device and device["Status"] == 1:
+                results[imei] = True
 
         return results
 
+    async def is_online(self, imei: str) -> bool:
+        result = await self.check_onlines([imei])
+        return result[imei]
+
     async def turn_on(self, imei: str, level=8) -> bool:
         
         
         timestamp = datetime.now().isoformat()
         payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "9203", "CommandValue": "1,1"}
+        level_payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "9722", "CommandValue": str(level)}
+
+        try:
+            response = await self.send_command(payload)
+        except Warning:
+            # the switch was queued, the level follows it through the outbox
+            if imei in self.queued:
+                await self.hold_command(level_payload)
+            raise
 
-        if await self.send_command(payload):
-            timestamp = datetime.now().isoformat()
-            payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "9722", "CommandValue": str(level)}
-            return await self.send_command(payload)
+        if response:
+            level_payload["timestamp"] = datetime.now().isoformat()
+            return await self.send_command(level_payload)
 
         return False
 
     async def turn_off(self, imei: str) -> bool:
-        result = await self.check_onlines([imei])
-        if result[imei] == False or result[imei] is None:
+        if not await self.can_send(imei):
             return False
         timestamp = datetime.now().isoformat()
         payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "9203", "CommandValue": "0,0"}
@@ -118,8 +167,7 @@ class Miwi:
 
     async def locate(self, imei: str) -> bool:
         try:
-            result = await self.check_onlines([imei])
-            if result[imei] == False or result[imei] is None:
+            if not await self.is_online(imei):
                 return False
             response = await self.send_command({"Imei": imei, "CommandCode": "0039", "CommandValue": ""})
         except Warning:
@@ -127,82 +175,142 @@ class Miwi:
 
         return response["Code"] == 0
 
-    async def set_fall_alert(self, imei: str, project) -> bool:
+    async def get_command_profile(self, imei: str, project="") -> CommandProfile:
+        if not project:
+            device = await Devices(self.dbo).get_device_by_imei(imei)
+            if not device:
+                raise NotFoundError("Device not found")
+            project = device.project
+
+        return await Settings(self.dbo).get_command_profile(project)
+
+    async def set_fall_alert(self, imei: str, project="") -> bool:
         try:
-            result = await self.check_onlines([imei])
-            if result[imei] == False or result[imei] is None:
+            if not await self.can_send(imei):
                 return False
-            setting = Settings(self.dbo).get_by_project(project)
-            if not setting or not setting.get("sensitivity"):
-                level = 8
-            else:
-                level_list = setting.get("sensitivity")
-                # get the first item if it's a list
-                level = int(level_list[0])
-            response = await self.turn_on(imei, level)
-            if response:
+            command_profile = await self.get_command_profile(imei, project)
+            response = await self.turn_on(imei, command_profile.commands["fall_alert"][1])
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
         return response["Code"] == 0
 
-    async def send_command(self, payload: dict, timeout=15):
-        headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"}
+    async def can_send(self, imei: str) -> bool:
+        # with the outbox on, commands for offline devices go on to send_command which queues them
+        return self.outbox.enabled or await self.is_online(imei)
+
+    async def hold_command(self, payload: dict):
+        outbox_id = await self.outbox.enqueue(self.dbo, payload)
+        self.queued.setdefault(payload["Imei"], []).append(outbox_id)
+
+    async def load_fingerprints(self, imeis: list[str]):
+        missing = [imei for imei in dict.fromkeys(imeis) if imei not in self.fingerprints_loaded]
+        if missing:
+            self.fingerprints.update(await CommandStates(self.dbo).get_fingerprints(missing))
+            self.fingerprints_loaded.update(missing)
+
+    async def send_command(self, payload: dict, timeout=None, hold=True):
+        imei = payload["Imei"]
+        code = payload.get("CommandCode")
+
+        fingerprint = None
+        if self.track_applied and code not in LIVE_COMMAND_CODES:
+            fingerprint = command_fingerprint(code, payload.get("CommandValue", ""))
+            if not self.force:
+                await self.load_fingerprints([imei])
+                if self.fingerprints.get((imei, code)) == fingerprint:
+                    # a different value still waiting for the device would overwrite the applied one
+                    if self.outbox.enabled:
+                        await self.outbox.discard(self.dbo, imei, code)
+                    MIWI_COMMANDS.inc("skipped")
+                    self.skipped.setdefault(imei, []).append(code)
+                    return {"Code": 0, "Message": "Unchanged, not sent", "Skipped": True}
+
+        hold = hold and self.outbox.enabled and code not in LIVE_COMMAND_CODES
+        if hold and not await self.is_online(imei):
+            await self.hold_command(payload)
+            raise Warning("Device is offline, command queued")
+
+        uri = "/api/command/sendcommand"
+
+        # reboot and power off must not be repeated on a lost answer
+        idempotent = payload.get("CommandCode") not in ONE_SHOT_COMMAND_CODES
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            r = await self.send_authorized("POST", uri, idempotent, timeout, json=payload)
+            response = r.json()
+            outcome = call_outcome(response)
+        except Exception as err:
+            outcome = err.__class__.__name__
+            raise
+        finally:
+            MIWI_CALL_SECONDS.observe(time.perf_counter() - start, uri, code, outcome)
 
-        async with httpx.AsyncClient() as client:
-            r = await client.post(
-                f"{self.api_endpoint}/api/command/sendcommand", headers=headers, json=payload, timeout=timeout
-            )
-        response = r.json()
         if response["Code"] == 0:
+            MIWI_COMMANDS.inc("sent")
+            if fingerprint:
+                await CommandStates(self.dbo).save_fingerprint(imei, code, fingerprint)
+                self.fingerprints[(imei, code)] = fingerprint
             return response
         elif response["Code"] == 1800:
             # Offline
+            if hold:
+                await self.hold_command(payload)
+                raise Warning("Device is offline, command queued")
             raise Warning("Device is offline")
 
         raise HTTPException(status_code=400, detail=response.get("Message", "Request failed"))
 
+    async def send_authorized(self, method: str, uri: str, idempotent: bool, timeout=None, **kwargs) -> httpx.Response:
+        # a rejected call never reached the device, it is repeated once with a fresh token
+        for attempt in range(2):
+            token = await self.tokens.get_token()
+            headers = {"Authorization": f"Bearer {token}"}
+            r = await send_request(method, uri, idempotent, timeout, headers=headers, **kwargs)
+            if attempt == 0 and is_auth_failure(r):
+                self.tokens.invalidate(token)
+                continue
+
+            return r
+
     async def request(self, uri: str, payload: dict, method="POST"):
-        headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"}
+        idempotent = get_route_name(uri) in IDEMPOTENT_ROUTES
 
-        async with httpx.AsyncClient() as client:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
             if method.upper() == "POST":
-                r = await client.post(f"{self.api_endpoint}{uri}", headers=headers, json=payload, timeout=30.0)
+                r = await self.send_authorized("POST", uri, idempotent, json=payload)
             else:
-                r = await client.get(f"{self.api_endpoint}{uri}", headers=headers, params=payload, timeout=30.0)
-        response = r.json()
+                r = await self.send_authorized("GET", uri, idempotent, params=payload)
+            response = r.json()
+            outcome = call_outcome(response)
+        except Exception as err:
+            outcome = err.__class__.__name__
+            raise
+        finally:
+            MIWI_CALL_SECONDS.observe(time.perf_counter() - start, uri, "", outcome)
+
         if ("Code" in response and response["Code"] == 0) or ("State" in response and response["State"] == 0):
             return response
 
         raise HTTPException(status_code=400, detail=response.get("Message", "Request failed"))
 
-    async def set_phone_book(self, imei: str) -> bool:
-        device = Devices(self.dbo).get_device_by_imei(imei)
-        if not device:
-            raise ValueError(status_code=404, detail="Device not found")
-
-        settings = Settings(self.dbo).get_by_project(device.project)
-        if not settings:
-            raise ValueError(status_code=404, detail="Settings not found")
-
-        sos_phone_numbers = settings.get("sos_phone_number", [])
-        if not sos_phone_numbers:
+    async def set_phone_book(self, imei: str, project="") -> bool:
+        command_profile = await self.get_command_profile(imei, project)
+        payload = command_profile.payload("phone_book", imei)
+        if not payload:
             raise ValueError("Phonebook settings not found")
 
-        phone_book_settings = []
-        for entry in sos_phone_numbers:
-            entry_number_list = entry.split(",")
-            for entry in entry_number_list:
-                new_entry = {"Name": "SOS", "Number": entry}
-                phone_book_settings.append(new_entry)
-        settings_payload = json.dumps(phone_book_settings)
         try:
-            response = await self.send_command({"Imei": imei, "CommandCode": "1106", "CommandValue": settings_payload})
-            if response:
+            response = await self.send_command(payload)
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
@@ -211,130 +319,107 @@ class Miwi:
     async def set_block_phone(self, imei: str) -> bool:
         timestamp = datetime.now().isoformat()
         try:
-            result = await self.check_onlines([imei])
-            if result[imei] == False or result[imei] is None:
+            if not await self.can_send(imei):
                 return False
             response = await self.send_command(
                 {"Imei": imei, "timestamp": timestamp, "CommandCode": "9601", "CommandValue": "1"}
             )
-            if response:
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
         return response["Code"] == 0
     
-    async def set_bodytemp(self, imei: str):
-        timestamp = datetime.now().isoformat()
+    def bodytemp_payload(self, imei: str) -> dict:
+        return {"Imei": imei, "Time": datetime.now().isoformat(), "CommandCode": "9113", "CommandValue": "1,1"}
 
-        payload = {
+    def health_command_payload(self, imei: str) -> dict:
+        return {
             "Imei": imei,
-            "Time": timestamp,
-            "CommandCode": "9113",
-            "CommandValue": '1,1'
+            "timestamp": datetime.now().isoformat(),
+            "CommandCode": "2815",
+            "CommandValue": '[{"TimeInterval":"300","Switch":"1"}]',
         }
-        try :
-            response = await self.send_command(payload)
-            if response:
-                update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
-        except Warning:
+
+    async def set_bodytemp(self, imei: str):
+        results = await self.send_composite(imei, [{"bodytemp": self.bodytemp_payload(imei)}])
+        if not results["bodytemp"]["success"]:
             return False
 
-    async def set_gpstrack(self, imei: str , project=""):
-        timestamp = datetime.now().isoformat()  
-        if project: 
-            setting = Settings(self.dbo).get_by_project(project)
-            print(f"set_gpstrack setting: {setting}" )
-            if setting and setting.get("gps_tracking_interval"):
-                interval = setting.get("gps_tracking_interval")
-            else:
-                interval = '10'
-            print(f"set_gpstrack interval: {interval}" )
-        payload = {
-            "Imei": imei,
-            "Time": timestamp,
-            "CommandCode": "0305",
-            "CommandValue": str(interval)
-        }        
-        try :
-            
-            response = await self.send_command(payload)
-            if response:
-                update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
-        except Warning:
+    async def set_gpstrack(self, imei: str, project=""):
+        command_profile = await self.get_command_profile(imei, project)
+        results = await self.send_composite(imei, [{"gpstrack": command_profile.payload("gpstrack", imei)}])
+        if not results["gpstrack"]["success"]:
             return False
-        
+
     async def set_health_command(self, imei: str) -> bool:
-        timestamp = datetime.now().isoformat()
-        try:
-            payload = {
-                "Imei": imei,
-                "timestamp": timestamp,
-                "CommandCode": "2815",
-                "CommandValue": '[{"TimeInterval":"300","Switch":"1"}]',
-            }
-            response = await self.send_command(payload)
-            if response:
-                update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
-        except Warning:
+        results = await self.send_composite(imei, [{"health": self.health_command_payload(imei)}])
+        if not results["health"]["success"]:
             return False
-        
 
-    async def set_health(self, imei: str) -> bool:
-        timestamp = datetime.now().isoformat()
-        result = await self.check_onlines([imei])
-        if result[imei] == False or result[imei] is None:
+    async def set_health(self, imei: str) -> bool | dict:
+        online, command_profile = await asyncio.gather(self.can_send(imei), self.get_command_profile(imei))
+        if not online:
             return False
-        device = Devices(self.dbo).get_device_by_imei(imei)
-        project = device.project if device else ""
-        print(f"set_health project: {project}")
-        await self.set_bodytemp(imei)
-        await self.set_gpstrack(imei, project)
-        await self.set_health_command(imei)
 
-        return True
+        # the three settings are independent, they go out together
+        results = await self.send_composite(
+            imei,
+            [
+                {
+                    "bodytemp": self.bodytemp_payload(imei),
+                    "gpstrack": command_profile.payload("gpstrack", imei),
+                    "health": self.health_command_payload(imei),
+                }
+            ],
+        )
 
-    async def set_call_center(self, imei: str) -> bool:
-        device = Devices(self.dbo).get_device_by_imei(imei)
-        if not device:
-            raise ValueError("Device not found")
+        return {"success": all(result["success"] for result in results.values()), "commands": results}
 
-        timestamp = datetime.now().isoformat()
-        settings = Settings(self.dbo).get_by_project(device.project)
-        if not settings or not settings.get("call_center_number"):
-            raise ValueError("Settings not found")
-        
-        
-        call_center_number_list = settings.get("call_center_number")
-        # Convert list to comma-separated string if it's a list, otherwise use as-is
-        if isinstance(call_center_number_list, list):
-            call_center_number_list = call_center_number_list
-        elif isinstance(call_center_number_list, str):
-            call_center_number_list = [call_center_number_list]
-        else:
-            call_center_number_list = []
-        
-        call_center_number = ",".join(call_center_number_list) 
-        print(call_center_number)
-        
-        if not call_center_number_list:
+    async def send_composite(self, imei: str, stages: list[dict[str, dict]], touch=True) -> dict[str, dict]:
+        # the sub-commands of a stage are sent concurrently, a stage only starts once the previous one succeeded
+        results = {}
+        for index, stage in enumerate(stages):
+            names = list(stage)
+            responses = await asyncio.gather(
+                *[self.send_command(stage[name]) for name in names], return_exceptions=True
+            )
+
+            for name, response in zip(names, responses, strict=True):
+                if isinstance(response, HTTPException):
+                    results[name] = {"success": False, "error": response.detail}
+                elif isinstance(response, Exception):
+                    results[name] = {"success": False, "error": str(response)}
+                elif isinstance(response, BaseException):
+                    raise response
+                else:
+                    results[name] = {"success": response["Code"] == 0, "result": response}
+
+            if not all(results[name]["success"] for name in names):
+                for skipped in stages[index + 1 :]:
+                    results.update({name: {"success": False, "error": "Skipped"} for name in skipped})
+                break
+
+        # one write for the whole composite
+        if touch and any(result["success"] and not result["result"].get("Skipped") for result in results.values()):
+            update_data = {"imei": imei, "updated": datetime.now().isoformat()}
+            await self.dbo.update_object("devices", update_data, "imei")
+
+        return results
+
+    async def set_call_center(self, imei: str, project="") -> bool:
+        command_profile = await self.get_command_profile(imei, project)
+        payload = command_profile.payload("call_center", imei)
+        if not payload:
             raise ValueError("Call center number not found")
-        
+
         try:
-            payload = {
-                "Imei": imei,
-                "timestamp": timestamp,
-                "CommandCode": "9602",
-                "CommandValue": call_center_number,
-            }
             response = await self.send_command(payload)
-            if response:
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
@@ -343,57 +428,30 @@ class Miwi:
     async def off_fall_alert(self, imei: str) -> bool:
         timestamp = datetime.now().isoformat()
         try:
-            result = await self.check_onlines([imei])
-            if result[imei] == False or result[imei] is None:
+            if not await self.can_send(imei):
                 return False
             response = await self.turn_off(imei)
-            if response:
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": timestamp}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
         return response["Code"] == 0
 
-    async def set_sos(self, imei: str) -> bool:
-        timestamp = datetime.now().isoformat()
-        result = await self.check_onlines([imei])
-        if result[imei] == False or result[imei] is None:
+    async def set_sos(self, imei: str, project="") -> bool:
+        if not await self.can_send(imei):
             return False
-        device = Devices(self.dbo).get_device_by_imei(imei)
-        if not device:
-            raise ValueError("Device not found")
-        settings = Settings(self.dbo).get_by_project(device.project)
-        if not settings or not settings.get("sos_phone_number"):
+        command_profile = await self.get_command_profile(imei, project)
+        payload = command_profile.payload("sos", imei)
+        if not payload:
             raise ValueError("Settings not found")
-        sos_phone_number_list = settings.get("sos_phone_number")
-        # convert to list as ["abc"] or ["abc","def"]
-        
-        if isinstance(sos_phone_number_list, list):
-            sos_phone_number_list = sos_phone_number_list
-        elif isinstance(sos_phone_number_list, str):
-            sos_phone_number_list = [sos_phone_number_list]
-        else:
-            sos_phone_number_list = []
-        
-        
-        sos_join_string = ",".join(sos_phone_number_list)
-        # phone_book_settings = []    
-        # for entry in sos_phone_number_list:
-        #     new_entry = {"Name": "SOS", "Number": entry}
-        #     phone_book_settings.append(new_entry)
-        # settings_payload = json.dumps(phone_book_settings)
-        
-        #get the type for the list 
-        print(type(sos_phone_number_list))
-        print(sos_phone_number_list)
-        
+
         try:
-            payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "0001", "CommandValue": sos_join_string}
             response = await self.send_command(payload)
-            if response:
+            if response and not response.get("Skipped"):
                 update_data = {"imei": imei, "updated": datetime.now().isoformat()}
-                self.dbo.update_object("devices", update_data, "imei")
+                await self.dbo.update_object("devices", update_data, "imei")
         except Warning:
             return False
 
@@ -413,8 +471,7 @@ class Miwi:
         
         timestamp = datetime.now().isoformat()
         try:
-            result = await self.check_onlines([imei])
-            if result[imei] == False or result[imei] is None:
+            if not await self.is_online(imei):
                 return False
             payload = {"Imei": imei, "timestamp": timestamp, "CommandCode": "0048", "CommandValue": ""}
             response = await self.send_command(payload)
@@ -423,6 +480,54 @@ class Miwi:
 
         return response["Code"] == 0
 
+    async def send_bulk(
+        self, command: str, imeis: list[str], project="", concurrency: int | None = None, timeout: float | None = None
+    ) -> dict[str, dict]:
+        if command not in BULK_COMMANDS:
+            raise ValueError(f"Unknown command '{command}'.")
+
+        concurrency = concurrency or int(get_config("miwitracker.bulk_concurrency", 20))
+        timeout = timeout or float(get_config("miwitracker.bulk_timeout", 30))
+        handler = getattr(self, BULK_COMMANDS[command])
+
+        # one device list fetch and one fingerprint lookup for the whole batch
+        onlines = await self.check_onlines(imeis, refresh=True)
+        if self.track_applied and not self.force:
+            await self.load_fingerprints(imeis)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def dispatch(imei: str) -> dict:
+            online = onlines[imei]
+            if not online and (command in LIVE_COMMANDS or not self.outbox.enabled):
+                return {"success": False, "online": False, "error": "Device is offline"}
+
+            async with semaphore:
+                try:
+                    async with asyncio.timeout(timeout):
+                        if command in PROFILE_COMMANDS:
+                            result = await handler(imei, project)
+                        else:
+                            result = await handler(imei)
+                except TimeoutError:
+                    return {"success": False, "online": online, "error": "Timed out"}
+                except HTTPException as err:
+                    return {"success": False, "online": online, "error": err.detail}
+                except Exception as err:
+                    return {"success": False, "online": online, "error": str(err)}
+
+            success = result.get("success", False) if isinstance(result, dict) else bool(result)
+            outcome = {"success": success, "online": online, "result": result}
+            if imei in self.queued:
+                outcome["queued"] = self.queued[imei]
+            if imei in self.skipped:
+                outcome["skipped"] = self.skipped[imei]
+
+            return outcome
+
+        results = await asyncio.gather(*[dispatch(imei) for imei in imeis])
+
+        return dict(zip(imeis, results, strict=True))
+
     async def get_group_list(self):
         payload = {"UserId": self.user_id, "MapType": "Google"}
 
@@ -433,7 +538,7 @@ class Miwi:
         if not project:
             raise ValueError("Project name is required.")
 
-        group_id = Projects(self.dbo).get_project_group_id(project)
+        group_id = await Projects(self.dbo).get_project_group_id(project)
         if group_id:
             raise ValueError(f"Group for project '{project}' already exists with Group ID {group_id}.")
 
@@ -449,7 +554,7 @@ class Miwi:
                 "name": project,
                 "miwi_group_id": group_id,
             }
-            self.dbo.update_object("projects", update_project_data, ["name"], True)
+            await self.dbo.update_object("projects", update_project_data, ["name"], True)
 
         return True
 
@@ -459,7 +564,7 @@ class Miwi:
 
         device = Devices(self.dbo)
 
-        project_devices = device.get_devices_by_project(project)
+        project_devices = await device.get_devices_by_project(project)
         if not project_devices:
             raise ValueError(f"No devices found for project '{project}'.")
 
@@ -472,7 +577,7 @@ class Miwi:
 
         response = await self.request("/api/organgroups/movedevicestoorgangroups", payload, "POST")
         for imei in filter_imeis_list:
-            existing_device = Devices(self.dbo).get_device_by_imei(imei)
+            existing_device = await Devices(self.dbo).get_device_by_imei(imei)
             if existing_device and existing_device.miwi_group_id != group_id:
                 update_data = {
                     "imei": imei,
@@ -480,7 +585,7 @@ class Miwi:
                     "miwi_group_id": group_id,
                     "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 }
-                self.dbo.update_object("devices", update_data, ["imei"], True)
+                await self.dbo.update_object("devices", update_data, ["imei"], True)
 
         return True
 
@@ -499,17 +604,17 @@ class Miwi:
             if not imei or not iccid:
                 continue
 
-            existing_device = devices_model.get_device_by_imei(imei)
+            existing_device = await devices_model.get_device_by_imei(imei)
             if existing_device and (existing_device.iccid != iccid):
                 updates.append({"imei": imei, "iccid": iccid, "updated": now})
 
         for upd in updates:
-            self.dbo.update_object("devices", upd, ["imei"], True)
+            await self.dbo.update_object("devices", upd, ["imei"], True)
 
         return True
 
     async def update_group_and_iccid(self, project: str):
-        group_id = Projects(self.dbo).get_project_group_id(project)
+        group_id = await Projects(self.dbo).get_project_group_id(project)
         if group_id:
             await self.update_group_id_for_imei(group_id, project)
             await self.update_iccid(group_id)
@@ -523,9 +628,8 @@ class Miwi:
             # get project by group_id
             project = ""
             query = Query()
-            query.Select("name").From("projects").Where("miwi_group_id = " + self.dbo.q(str(group_id)))
-            self.dbo.execute(query)
-            result = self.dbo.fetch_one()
+            query.Select("name").From("projects").Where("miwi_group_id = ?", str(group_id))
+            result = await self.dbo.fetch_one(query)
             project = result["name"] if result else ""
 
             payload = {"UserId": self.user_id, "GroupId": group_id}
@@ -537,7 +641,7 @@ class Miwi:
                     "name": project,
                     "miwi_group_id": None,
                 }
-                self.dbo.update_object("projects", update_project_data, "name", True)
+                await self.dbo.update_object("projects", update_project_data, "name", True)
 
             return True
 
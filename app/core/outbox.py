@@ -0,0 +1,259 @@
+import asyncio
+import json
+import random
+import uuid
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from app.config import get_config
+from app.core.db import AsyncDatabase
+from app.core.logger import get_logger
+from app.core.metrics import OUTBOX_COMMANDS
+from app.core.query import Query
+
+OUTBOX_TABLE = "command_outbox"
+OUTBOX_EVENTS = ("enqueued", "sent", "retried", "held", "failed")
+
+
+class CommandOutbox:
+    def __init__(self):
+        outbox_config = get_config("outbox", {})
+        self.enabled = int(outbox_config.get("enabled", 0)) == 1
+        self.workers = int(outbox_config.get("workers", 4))
+        self.batch_size = int(outbox_config.get("batch_size", 100))
+        self.poll_interval = float(outbox_config.get("poll_interval", 5))
+        self.max_attempts = int(outbox_config.get("max_attempts", 10))
+        self.backoff_base = float(outbox_config.get("backoff_base", 10))
+        self.backoff_max = float(outbox_config.get("backoff_max", 1800))
+        # claimed rows of a crashed worker are picked up again after this many seconds
+        self.lease = int(outbox_config.get("lease", 300))
+        self.offline_recheck = float(outbox_config.get("offline_recheck", 15))
+
+        self.miwi_factory: Callable | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+        # seconds from enqueue to delivery of the recently sent commands
+        self.latencies = deque(maxlen=1000)
+
+        self.logger = get_logger()
+
+    async def enqueue(self, dbo: AsyncDatabase, payload: dict) -> int:
+        imei = payload["Imei"]
+        code = payload["CommandCode"]
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # the latest value of a setting wins over one still waiting for the device
+        await self.discard(dbo, imei, code, False)
+
+        record = {
+            "imei": imei,
+            "command_code": code,
+            "command_value": payload.get("CommandValue", ""),
+            "payload": json.dumps(payload),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt": now,
+            "created": now,
+        }
+        outbox_id = await dbo.insert_object(OUTBOX_TABLE, record)
+        OUTBOX_COMMANDS.inc("enqueued")
+
+        return outbox_id
+
+    async def discard(self, dbo: AsyncDatabase, imei: str, code: str, commit=True):
+        query = Query()
+        query.Delete(OUTBOX_TABLE).Where("imei = ?", imei).Where("command_code = ?", code).Where("status = 'pending'")
+        await dbo.execute(query)
+        if commit:
+            await dbo.commit()
+
+    async def start(self, miwi_factory: Callable):
+        if not self.enabled or self._tasks:
+            return
+
+        self.miwi_factory = miwi_factory
+        self._queue = asyncio.Queue(maxsize=self.batch_size)
+        self._tasks = [asyncio.create_task(self._poll())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # rows still claimed by this process are released once their lease runs out
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _poll(self):
+        while True:
+            rows = []
+            try:
+                rows = await self._claim()
+                if rows:
+                    await self._dispatch(rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(f"Command outbox poll failed: {err}")
+
+            if len(rows) < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self) -> list[dict]:
+        token = uuid.uuid4().hex
+        dbo = await AsyncDatabase.connect()
+        try:
+            await dbo.execute(
+                f"UPDATE `{OUTBOX_TABLE}` SET status = 'sending', claimed_by = ?, claimed_at = NOW() "
+                "WHERE (status = 'pending' AND next_attempt <= NOW()) "
+                "OR (status = 'sending' AND claimed_at < NOW() - INTERVAL ? SECOND) "
+                "ORDER BY id LIMIT ?",
+                token,
+                self.lease,
+                self.batch_size,
+            )
+            await dbo.commit()
+
+            query = Query()
+            query.Select("*").From(OUTBOX_TABLE).Where("claimed_by = ?", token).Order("id")
+            return await dbo.fetch_all(query)
+        finally:
+            await dbo.close()
+
+    async def _dispatch(self, rows: list[dict]):
+        # a device gets its commands in order from one worker
+        by_imei: dict[str, list[dict]] = {}
+        for row in rows:
+            by_imei.setdefault(row["imei"], []).append(row)
+
+        dbo = await AsyncDatabase.connect()
+        try:
+            # held until the device status snapshot shows the device online
+            onlines = await self.miwi_factory(dbo).check_onlines(list(by_imei))
+            offline = [row["id"] for imei, group in by_imei.items() if not onlines.get(imei) for row in group]
+            if offline:
+                await self._release(dbo, offline, self.offline_recheck)
+                OUTBOX_COMMANDS.inc("held", amount=len(offline))
+        finally:
+            await dbo.close()
+
+        for imei, group in by_imei.items():
+            if onlines.get(imei):
+                await self._queue.put(group)
+
+    async def _work(self):
+        while True:
+            group = await self._queue.get()
+            try:
+                await self._send(group)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.error(f"Command outbox delivery to {group[0]['imei']} failed: {err}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, group: list[dict]):
+        dbo = await AsyncDatabase.connect()
+        try:
+            # held commands already passed the unchanged check (or were forced) when they were queued
+            miwi = self.miwi_factory(dbo, force=True)
+            delivered = False
+            for index, row in enumerate(group):
+                try:
+                    await miwi.send_command(json.loads(row["payload"]), hold=False)
+                except Warning:
+                    # went offline since the snapshot, the rest waits with it
+                    ids = [pending["id"] for pending in group[index:]]
+                    await self._release(dbo, ids, self.offline_recheck)
+                    OUTBOX_COMMANDS.inc("held", amount=len(ids))
+                    break
+                except HTTPException as err:
+                    await self._retry(dbo, row, str(err.detail))
+                    continue
+                except Exception as err:
+                    await self._retry(dbo, row, str(err))
+                    continue
+
+                now = datetime.now()
+                sent_data = {"id": row["id"], "status": "sent", "sent": now, "claimed_by": None}
+                await dbo.update_object(OUTBOX_TABLE, sent_data, "id", True)
+
+                OUTBOX_COMMANDS.inc("sent")
+                self.latencies.append((now - row["created"]).total_seconds())
+                delivered = True
+
+            # only a delivered command touches the device, retried and held ones did not reach it
+            if delivered:
+                await dbo.update_object("devices", {"imei": group[0]["imei"], "updated": datetime.now()}, "imei")
+        finally:
+            await dbo.close()
+
+    async def _retry(self, dbo: AsyncDatabase, row: dict, error: str):
+        attempts = row["attempts"] + 1
+        update_data = {"id": row["id"], "attempts": attempts, "last_error": error[:255], "claimed_by": None}
+
+        if attempts >= self.max_attempts:
+            update_data["status"] = "failed"
+            OUTBOX_COMMANDS.inc("failed")
+            self.logger.warning(f"Command outbox gave up on {row['id']} ({row['imei']}) after {attempts} attempts")
+        else:
+            # exponential backoff with full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)))
+            update_data["status"] = "pending"
+            update_data["next_attempt"] = datetime.now() + timedelta(seconds=delay)
+            OUTBOX_COMMANDS.inc("retried")
+
+        await dbo.update_object(OUTBOX_TABLE, update_data, "id", True)
+
+    async def _release(self, dbo: AsyncDatabase, ids: list[int], delay: float):
+        next_attempt = datetime.now() + timedelta(seconds=delay)
+        query = Query()
+        query.Update(OUTBOX_TABLE).Set(["status = 'pending'", "claimed_by = NULL", "next_attempt = ?"], next_attempt)
+        query.WhereIn("id", ids)
+        await dbo.execute(query)
+        await dbo.commit()
+
+    async def depth(self, dbo: AsyncDatabase) -> dict:
+        query = Query()
+        query.Select(["status", "COUNT(*) AS total", "MIN(created) AS oldest"]).From(OUTBOX_TABLE).Group("status")
+        rows = await dbo.fetch_all(query)
+
+        now = datetime.now()
+        return {
+            row["status"]: {
+                "count": row["total"],
+                "oldest_age": round((now - row["oldest"]).total_seconds(), 1) if row["oldest"] else None,
+            }
+            for row in rows
+        }
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float | None:
+            if not latencies:
+                return None
+
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return {
+            "enabled": self.enabled,
+            "running": bool(self._tasks),
+            "workers": self.workers,
+            "in_flight": self._queue.qsize() if self._queue else 0,
+            **{event: OUTBOX_COMMANDS.get(event) for event in OUTBOX_EVENTS},
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+
+OUTBOX = CommandOutbox()
+
+
+def get_outbox() -> CommandOutbox:
+    return OUTBOX
@@ -1,20 +1,41 @@
 import copy
 
+from app.core.cache import TTLCache
+
+# rendered sql by query shape, queries that only differ by their bound values render once
+SQL_CACHE = TTLCache("query_sql", ttl=float("inf"), maxsize=2048)
+
+
+def _hashable(elements: str | list) -> str | tuple:
+    return tuple(elements) if isinstance(elements, list) else elements
+
+
+def _check_params(method: str, conditions: str | list, params: tuple):
+    # glue used to be the second positional argument, a positional "OR" would now silently bind as a value
+    if params and "?" not in "".join(conditions if isinstance(conditions, list) else [conditions]):
+        raise TypeError(f"{method}() got values but its conditions have no ? placeholder, pass glue as a keyword")
+
 
 class QueryElement:
-    def __init__(self, name: str, elements: str | list, glue: str = ","):
+    __slots__ = ("name", "elements", "params", "glue")
+
+    def __init__(self, name: str, elements: str | list, glue: str = ",", params: list | tuple = ()):
         self.elements: list[str] = []
+        self.params: list = []
         self.name = name
         self.glue = glue
 
-        self.append(elements)
+        self.append(elements, params)
 
-    def append(self, elements: str | list[str]):
+    def append(self, elements: str | list[str], params: list | tuple = ()):
         if isinstance(elements, list):
             self.elements.extend(elements)
         else:
             self.elements.append(elements)
 
+        # values bound to the `?` placeholders of the elements, in order
+        self.params.extend(params)
+
     def __str__(self) -> str:
         if self.name[-2:] == "()":
             return f"{self.name[:-2]}({self.glue.join(map(str, self.elements))})\n"
@@ -22,20 +43,40 @@ class QueryElement:
             return f"{self.name} {self.glue.join(map(str, self.elements))}\n"
 
     def __deepcopy__(self, memo):
-        clone = type(self)(self.name, self.elements, self.glue)
-
-        for k, v in self.__dict__.items():
-            if hasattr(v, "__class__") and issubclass(v.__class__, object):
-                clone.__dict__[k] = copy.deepcopy(v)
-            elif isinstance(v, list):
-                clone.__dict__[k] = [copy.deepcopy(element) for element in v]
-            else:
-                setattr(clone, k, copy.deepcopy(v))
+        # elements are strings, only the lists need copying
+        clone = object.__new__(type(self))
+        clone.name = self.name
+        clone.glue = self.glue
+        clone.elements = self.elements.copy()
+        clone.params = copy.deepcopy(self.params, memo)
 
         return clone
 
 
 class Query:
+    __slots__ = (
+        "type",
+        "_select",
+        "_alias",
+        "_from",
+        "_where",
+        "_group",
+        "_having",
+        "_join",
+        "_order",
+        "_limit",
+        "_offset",
+        "_insert",
+        "_values",
+        "_set",
+        "_columns",
+        "_delete",
+        "_update",
+        "auto_increment_field",
+        "_shape",
+        "_sql",
+    )
+
     def __init__(self):
         self.type = None
 
@@ -60,7 +101,16 @@ class Query:
 
         self.auto_increment_field = False
 
+        # builder calls without their bound values, identifies the rendered sql
+        self._shape = []
+        self._sql = None
+
+    def _record(self, *call):
+        self._shape.append(call)
+        self._sql = None
+
     def Select(self, columns: str | list[str]) -> "Query":
+        self._record("select", _hashable(columns))
         self.type = "select"
 
         if self._select:
@@ -71,6 +121,7 @@ class Query:
         return self
 
     def From(self, table: str, alias: str | None = None) -> "Query":
+        self._record("from", table, alias)
         if alias:
             table += f" AS {alias}"
 
@@ -81,25 +132,25 @@ class Query:
 
         return self
 
-    def Where(self, conditions, glue="AND") -> "Query":
+    def Where(self, conditions, *params, glue="AND") -> "Query":
+        _check_params("Where", conditions, params)
+        self._record("where", _hashable(conditions), glue)
         if self._where:
-            self._where.append(conditions)
+            self._where.append(conditions, params)
         else:
             glue = glue.upper()
-            self._where = QueryElement("WHERE", conditions, f" {glue} ")
+            self._where = QueryElement("WHERE", conditions, f" {glue} ", params)
 
         return self
 
     def WhereIn(self, key: str, key_values: list[int] | list[str]) -> "Query":
-        if type(key_values[0]) == int:
-            key_values = [str(x) for x in key_values]
-            self.Where(f"{key} IN ({','.join(key_values)})")
-        else:
-            self.Where(f"{key} IN ({','.join([str(x) for x in key_values])})")
+        if not key_values:
+            return self.Where("0 = 1")
 
-        return self
+        return self.Where(f"{key} IN ({','.join(['?'] * len(key_values))})", *key_values)
 
     def Group(self, columns: str | list[str]) -> "Query":
+        self._record("group", _hashable(columns))
         if self._group:
             self._group.append(columns)
         else:
@@ -107,26 +158,30 @@ class Query:
 
         return self
 
-    def Having(self, conditions: list[str] | str, glue="AND") -> "Query":
+    def Having(self, conditions: list[str] | str, *params, glue="AND") -> "Query":
+        _check_params("Having", conditions, params)
+        self._record("having", _hashable(conditions), glue)
         if self._having:
-            self._having.append(conditions)
+            self._having.append(conditions, params)
         else:
             glue = glue.upper()
-            self._having = QueryElement("HAVING", conditions, f" {glue} ")
+            self._having = QueryElement("HAVING", conditions, f" {glue} ", params)
 
         return self
 
-    def Join(self, join_type: str, table: str, condition: str | None = None) -> "Query":
+    def Join(self, join_type: str, table: str, condition: str | None = None, *params) -> "Query":
+        self._record("join", join_type, table, condition)
         join_type = join_type.upper() + " JOIN"
 
         if condition:
-            self._join.append(QueryElement(join_type, [table, condition], " ON "))
+            self._join.append(QueryElement(join_type, [table, condition], " ON ", params))
         else:
             self._join.append(QueryElement(join_type, table))
 
         return self
 
     def Order(self, columns: str | list[str]) -> "Query":
+        self._record("order", _hashable(columns))
         if self._order:
             self._order.append(columns)
         else:
@@ -135,21 +190,24 @@ class Query:
         return self
 
     def Insert(self, table: str, increment_field=False) -> "Query":
+        self._record("insert", table)
         self.type = "insert"
         self._insert = QueryElement("INSERT INTO", table)
         self.auto_increment_field = increment_field
 
         return self
 
-    def Values(self, values: list | str) -> "Query":
+    def Values(self, values: list | str, *params) -> "Query":
+        self._record("values", _hashable(values))
         if self._values:
-            self._values.append(values)
+            self._values.append(values, params)
         else:
-            self._values = QueryElement("()", values, "),(")
+            self._values = QueryElement("()", values, "),(", params)
 
         return self
 
     def Columns(self, columns: str | list[str]) -> "Query":
+        self._record("columns", _hashable(columns))
         if self._columns:
             self._columns.append(columns)
         else:
@@ -158,30 +216,35 @@ class Query:
         return self
 
     def Update(self, table: str) -> "Query":
+        self._record("update", table)
         self.type = "update"
         self._update = QueryElement("UPDATE", table)
 
         return self
 
-    def Set(self, conditions: list[str] | str, glue=",") -> "Query":
+    def Set(self, conditions: list[str] | str, *params, glue=",") -> "Query":
+        self._record("set", _hashable(conditions), glue)
         if self._set:
-            self._set.append(conditions)
+            self._set.append(conditions, params)
         else:
             glue = glue.upper()
-            self._set = QueryElement("SET", conditions, f" {glue} ")
+            self._set = QueryElement("SET", conditions, f" {glue} ", params)
 
         return self
 
     def Alias(self, alias: str) -> "Query":
+        self._record("alias", alias)
         self._alias = alias
         return self
 
     def Limit(self, limit=0, offset=0) -> "Query":
+        self._record("limit", limit, offset)
         self._limit = limit
         self._offset = offset
         return self
 
     def Delete(self, table: str) -> "Query":
+        self._record("delete")
         self.type = "delete"
         self._delete = QueryElement("DELETE", "")
         self.From(table)
@@ -197,6 +260,7 @@ class Query:
         return query_str
 
     def clear(self, clause: str | None = None) -> "Query":
+        self._record("clear", clause)
         match clause:
             case "alias":
                 self._alias = None
@@ -260,7 +324,34 @@ class Query:
 
         return self
 
+    @property
+    def params(self) -> list:
+        # bound values in the order their placeholders appear in the rendered sql
+        match self.type:
+            case "select":
+                elements = [*self._join, self._where, self._having]
+            case "insert":
+                elements = [self._set] if self._set else [self._values]
+            case "update":
+                elements = [*self._join, self._set, self._where]
+            case "delete":
+                elements = [*self._join, self._where]
+            case _:
+                elements = []
+
+        return [param for element in elements if element for param in element.params]
+
     def __str__(self):
+        if self._sql is None:
+            key = tuple(self._shape)
+            self._sql = SQL_CACHE.get(key)
+            if self._sql is None:
+                self._sql = self.render()
+                SQL_CACHE.set(key, self._sql)
+
+        return self._sql
+
+    def render(self) -> str:
         query_str = ""
 
         match self.type:
@@ -328,14 +419,16 @@ class Query:
         return query_str
 
     def __deepcopy__(self, memo):
-        clone = type(self)()
-
-        for k, v in self.__dict__.items():
-            if hasattr(v, "__class__") and issubclass(v.__class__, object):
-                clone.__dict__[k] = copy.deepcopy(v)
-            elif isinstance(v, list):
-                clone.__dict__[k] = [copy.deepcopy(element) for element in v]
-            else:
-                setattr(clone, k, copy.deepcopy(v))
+        clone = object.__new__(type(self))
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, QueryElement):
+                value = copy.deepcopy(value, memo)
+            elif name == "_shape":
+                value = value.copy()
+            elif isinstance(value, list):
+                value = [copy.deepcopy(element, memo) for element in value]
+
+            setattr(clone, name, value)
 
         return clone
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import time
+
+import httpx
+
+from app.config import get_config
+from app.core.http import get_client, get_route_name, get_timeout
+from app.core.limits import get_limiter
+from app.core.logger import get_logger
+from app.schema.exceptions import UpstreamError, UpstreamUnavailable
+
+# route name => breaker, created on first use
+BREAKERS: dict[str, "CircuitBreaker"] = {}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        miwi_config = get_config("miwitracker", {})
+        self.name = name
+        self.failure_threshold = int(miwi_config.get("breaker_failure_threshold", 5))
+        self.reset_timeout = float(miwi_config.get("breaker_reset_timeout", 30))
+        self.half_open_max = int(miwi_config.get("breaker_half_open_max", 1))
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.rejected = 0
+
+    def before_call(self):
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise UpstreamUnavailable(
+                    f"Miwi api '{self.name}' is unavailable, retry in {self.retry_after()} seconds", status=503
+                )
+
+            self.half_open()
+
+        if self.state == HALF_OPEN:
+            # a trial that never reported back (e.g. cancelled) must not keep the breaker half open
+            if self.trials >= self.half_open_max and time.monotonic() - self.opened_at >= 2 * self.reset_timeout:
+                self.half_open()
+
+            # only a few trial calls probe a recovering upstream
+            if self.trials >= self.half_open_max:
+                self.rejected += 1
+                raise UpstreamUnavailable(f"Miwi api '{self.name}' is recovering, retry shortly", status=503)
+
+            self.trials += 1
+
+    def half_open(self):
+        self.state = HALF_OPEN
+        self.trials = 0
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                get_logger().warning(
+                    f"Circuit breaker for Miwi api '{self.name}' opened after {self.failures} failures"
+                )
+
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        if self.state != OPEN:
+            return 0
+
+        return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def stats(self) -> dict:
+        return {
+            "route": self.name,
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after(),
+        }
+
+
+def get_breaker(uri: str) -> CircuitBreaker:
+    route = get_route_name(uri)
+    if route not in BREAKERS:
+        BREAKERS[route] = CircuitBreaker(route)
+
+    return BREAKERS[route]
+
+
+def backoff_delay(attempt: int) -> float:
+    base = float(get_config("miwitracker.retry_backoff_base", 0.2))
+    cap = float(get_config("miwitracker.retry_backoff_max", 2))
+
+    # full jitter
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def send_request(
+    method: str, uri: str, idempotent: bool = False, read_timeout: float | None = None, **kwargs
+) -> httpx.Response:
+    # one Miwi api call through the breaker, the rate / concurrency limiter and the retry policy
+    breaker = get_breaker(uri)
+    limiter = get_limiter(uri)
+    attempts = int(get_config("miwitracker.retry_attempts", 3))
+    timeout = get_timeout(uri, read_timeout)
+
+    for attempt in range(1, attempts + 1):
+        breaker.before_call()
+
+        error = None
+        try:
+            async with limiter.slot() as slot:
+                response = await get_client().request(method, uri, timeout=timeout, **kwargs)
+                slot.check(response)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as err:
+            # never reached the upstream, safe to repeat any call
+            error = err
+            retryable = True
+        except (httpx.TimeoutException, httpx.TransportError) as err:
+            error = err
+            retryable = idempotent
+        else:
+            if not slot.overloaded:
+                breaker.record_success()
+                return response
+
+            error = UpstreamError(f"Miwi api '{breaker.name}' answered HTTP {response.status_code}")
+            retryable = idempotent
+
+        breaker.record_failure()
+        if not retryable or attempt == attempts or breaker.state == OPEN:
+            break
+
+        await asyncio.sleep(backoff_delay(attempt))
+
+    if isinstance(error, UpstreamError):
+        raise error
+
+    raise UpstreamError(f"Miwi api '{breaker.name}' failed: {error.__class__.__name__} {error}") from error
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from app.config import get_config
+from app.core.db import AsyncDatabase
+from app.core.logger import get_logger
+from app.core.query import Query
+from app.core.resilience import send_request
+
+TOKEN_CACHE_KEY = "miwi.access_token"
+
+
+class TokenManager:
+    def __init__(self):
+        miwi_config = get_config("miwitracker", {})
+        self.app_id = miwi_config.get("app_id", "")
+        self.app_key = miwi_config.get("app_key", "")
+
+        # tokens are treated as expired 2 weeks after they were issued
+        self.lifetime = timedelta(hours=float(miwi_config.get("token_lifetime", 24 * 14)))
+        self.refresh_ahead = timedelta(hours=float(miwi_config.get("token_refresh_ahead", 24)))
+
+        self.token = ""
+        self.expires_at: datetime | None = None
+        # a token Miwi rejected, never taken from the shared cache again
+        self.revoked = ""
+        self._refresh_task: asyncio.Task | None = None
+
+        self.logger = get_logger()
+
+    async def get_token(self) -> str:
+        now = datetime.now()
+        if self.token and self.expires_at and now < self.expires_at:
+            if now >= self.expires_at - self.refresh_ahead:
+                # still usable, renew in the background
+                self._start_refresh()
+
+            return self.token
+
+        await asyncio.shield(self._start_refresh())
+
+        return self.token
+
+    def invalidate(self, token: str):
+        # callers that saw the same rejection share one refresh, a token renewed meanwhile is kept
+        if token != self.token:
+            return
+
+        self.logger.warning("Miwi rejected the access token, fetching a new one")
+        self.revoked = token
+        self.token = ""
+        self.expires_at = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        # single flight: concurrent callers share the running refresh
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_error)
+
+        return self._refresh_task
+
+    def _log_refresh_error(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            self.logger.error(f"Failed to refresh Miwi access token: {task.exception()}")
+
+    async def _refresh(self):
+        # another worker may already have stored a fresh token
+        record = await self._load_cached()
+        if record and str(record["value"]) != self.revoked:
+            issued = record["last_updated"]
+            if datetime.now() < issued + self.lifetime - self.refresh_ahead:
+                self._set_token(str(record["value"]), issued)
+                return
+
+        token = await self.fetch_token()
+        issued = datetime.now()
+        if token != self.token:
+            await self._save_cached(token, issued)
+
+        self._set_token(token, issued)
+
+    def _set_token(self, token: str, issued: datetime):
+        self.token = token
+        self.expires_at = issued + self.lifetime
+
+    async def _load_cached(self) -> dict | None:
+        # the callers waiting on the refresh hold their own connections, use a reserved one
+        dbo = await AsyncDatabase.connect(reserved=True)
+        try:
+            query = Query()
+            query.Select("*").From("caches").Where("`key` = ?", TOKEN_CACHE_KEY)
+            return await dbo.fetch_one(query)
+        finally:
+            await dbo.close()
+
+    async def _save_cached(self, token: str, issued: datetime):
+        dbo = await AsyncDatabase.connect(reserved=True)
+        try:
+            insert_data = {
+                "key": TOKEN_CACHE_KEY,
+                "value": token,
+                "last_updated": issued.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            await dbo.insert_object("caches", insert_data, True)
+        finally:
+            await dbo.close()
+
+    async def fetch_token(self) -> str:
+        uri = "/api/token/get_token"
+        timestamp = int(datetime.now().timestamp())
+        password = self.app_key + str(self.app_id) + str(timestamp)
+        password_md5 = hashlib.md5(password.encode()).hexdigest()
+
+        r = await send_request(
+            "POST", uri, True, json={"AppId": self.app_id, "Password": password_md5, "Timestamp": timestamp}
+        )
+
+        response = r.json()
+        if response:
+            if response["Code"] == 0:
+                return response["Result"]["AccessToken"]
+
+            raise HTTPException(status_code=400, detail=response["Message"])
+
+        raise HTTPException(status_code=400, detail="Failed to fetch token")
+
+
+TOKEN_MANAGER = TokenManager()
+
+
+def get_token_manager() -> TokenManager:
+    return TOKEN_MANAGER
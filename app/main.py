@@ -3,13 +3,16 @@ import pydantic
 from fastapi import FastAPI, HTTPException
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from app.config import get_config
-from app.core.logger import get_logger
-from app.routes import devices, groups, projects, settings
+from app.core import db, http, metrics
+from app.core.logger import get_logger, stop_logging
+from app.core.miwi import Miwi
+from app.core.outbox import get_outbox
+from app.routes import devices, groups, projects, settings, status
 from app.schema.exceptions import AppException
 from app.schema.response import ResponsePayload
 
@@ -21,9 +24,15 @@ origins = get_config("server.allow_origins", "*")
 async def lifespan(server: FastAPI):
     # Startup
     get_logger().info(f"Starting {project_name}...")
+    await http.open_client()
+    await db.warm_schema_cache()
+    await get_outbox().start(Miwi)
     yield
     # Shutdown
+    await get_outbox().stop()
+    await http.close_client()
     get_logger().info(f"{project_name} shutdown complete.")
+    stop_logging()
 
 
 class SPAStaticFiles(StaticFiles):
@@ -54,11 +63,20 @@ server.include_router(projects.router)
 server.include_router(devices.router)
 server.include_router(settings.router)
 server.include_router(groups.router)
+server.include_router(status.router)
+
+server.add_middleware(db.QueryStatsMiddleware)
+server.add_middleware(metrics.MetricsMiddleware)
+
+
+@server.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @server.exception_handler(pydantic.ValidationError)
 async def validation_error_handler(request, exc: pydantic.ValidationError):
-    get_logger().warning("validation_error_handler", exc)
+    get_logger().warning("validation_error_handler: %s", exc)
     error_msg = "Invalid Form Data: \n"
     for error in exc.errors():
         error_msg += f"{error.get('loc', '')}\n"
@@ -70,15 +88,15 @@ async def validation_error_handler(request, exc: pydantic.ValidationError):
 
 @server.exception_handler(AppException)
 async def app_error_handler(request, exc: AppException):
-    get_logger().warning("app_error_handler", exc)
+    get_logger().warning("app_error_handler: %s", exc)
     resp = ResponsePayload(success=False, message=f"An unexpected error occurred: {exc.detail}")
 
-    return JSONResponse(content=resp.model_dump(), status_code=500)
+    return JSONResponse(content=resp.model_dump(), status_code=exc.status)
 
 
 @server.exception_handler(mariadb.DatabaseError)
 async def database_error_handler(request, exc: mariadb.DatabaseError):
-    get_logger().error("Database Error", exc)
+    get_logger().error("Database Error: %s", exc, exc_info=exc)
     resp = ResponsePayload(success=False, message="Database error occurred")
 
     return JSONResponse(content=resp.model_dump(), status_code=500)
@@ -86,7 +104,7 @@ async def database_error_handler(request, exc: mariadb.DatabaseError):
 
 @server.exception_handler(Exception)
 async def general_exception_handler(request, exc: Exception):
-    get_logger().error("general_exception_handler", exc)
+    get_logger().error("general_exception_handler: %s", exc, exc_info=exc)
     resp = ResponsePayload(success=False, message=f"An unexpected error occurred: {str(exc)}")
 
     return JSONResponse(content=resp.model_dump(), status_code=500)
@@ -0,0 +1,36 @@
+import hashlib
+from datetime import datetime
+
+from app.config import get_config
+from app.core.db import AsyncDatabase, Query
+
+
+def command_fingerprint(code: str, value: str) -> str:
+    return hashlib.sha256(f"{code}\n{value}".encode()).hexdigest()
+
+
+class CommandStates:
+    def __init__(self, dbo: AsyncDatabase):
+        self.dbo = dbo
+
+    async def get_fingerprints(self, imeis: list[str]) -> dict[tuple[str, str], str]:
+        # (imei, command code) => fingerprint of the last value the device accepted
+        chunk_size = int(get_config("database.bulk_chunk_size", 1000))
+
+        results = []
+        for start in range(0, len(imeis), chunk_size):
+            query = Query()
+            query.Select(["imei", "command_code", "fingerprint"]).From("device_command_state")
+            query.WhereIn("imei", imeis[start : start + chunk_size])
+            results += await self.dbo.fetch_all(query) or []
+
+        return {(row["imei"], row["command_code"]): row["fingerprint"] for row in results}
+
+    async def save_fingerprint(self, imei: str, code: str, fingerprint: str):
+        row = {
+            "imei": imei,
+            "command_code": code,
+            "fingerprint": fingerprint,
+            "applied": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        await self.dbo.bulk_upsert("device_command_state", [row], ["imei", "command_code"])
@@ -3,48 +3,124 @@ from datetime import datetime
 import httpx
 
 from app.config import get_config
-from app.core.db import Database, Query
+from app.core.db import AsyncDatabase, Query, escape_like
+from app.core.logger import get_logger
 from app.schema.device import Device
+from app.schema.exceptions import BadRequestError
+
+# prebuilt hot lookups, their sql renders once and each call only binds the values
+DEVICE_BY_IMEI = Query().Select("*").From("devices").Where("imei = ?")
+
+SEARCH_FIELDS = ["imei", "iccid"]
 
 
 class Devices:
-    def __init__(self, dbo: Database):
+    def __init__(self, dbo: AsyncDatabase):
         self.dbo = dbo
 
-    def get_devices(self, project: str, filters: dict[str, any]) -> list[Device]:
+    async def get_devices(self, project: str, filters: dict[str, any]) -> list[Device] | list[dict] | dict:
+        fields = self.get_projection(filters.get("fields"))
+        indexed_search = bool(filters.get("search")) and await self.has_indexed_search()
+
         query = Query()
-        query.Select("*").From("devices")
+        query.Select(", ".join(fields) if fields else "*").From("devices")
+        self.apply_filters(query, project, filters, indexed_search)
+
+        # keyset pagination on id, `after` also applies to an unpaged listing
+        limit = int(filters["limit"]) if filters.get("limit") else 0
+        if filters.get("after"):
+            query.Where("id > ?", int(filters["after"]))
+        if filters.get("after") or limit > 0:
+            query.Order("id ASC")
+
+        if limit <= 0:
+            results = await self.dbo.fetch_all(query)
+            return self.to_devices(results, fields)
+
+        # one extra row tells whether there is a next page
+        query.Limit(limit + 1)
+
+        results = await self.dbo.fetch_all(query) or []
+        items = self.to_devices(results[:limit], fields)
+        next_cursor = results[limit - 1]["id"] if len(results) > limit else None
 
+        total = None
+        if filters.get("total"):
+            count_query = Query()
+            count_query.Select("COUNT(*)").From("devices")
+            self.apply_filters(count_query, project, filters, indexed_search)
+            total = await self.dbo.fetch_result(count_query)
+
+        return {"items": items, "next": next_cursor, "total": total}
+
+    def get_projection(self, fields: str | list[str] | None) -> list[str]:
+        if not fields:
+            return []
+
+        if isinstance(fields, str):
+            fields = fields.split(",")
+
+        fields = [field.strip() for field in fields if field.strip()]
+        unknown = [field for field in fields if field not in Device.model_fields]
+        if unknown:
+            raise BadRequestError(f"Unknown device fields: {', '.join(unknown)}")
+
+        # the cursor needs the id
+        return list(dict.fromkeys(["id", *fields]))
+
+    def apply_filters(self, query: Query, project: str, filters: dict[str, any], indexed_search=False):
         if filters.get("id"):
-            query.Where("id = " + int(filters["id"]))
+            query.Where("id = ?", int(filters["id"]))
         elif filters.get("imei"):
-            query.Where("imei = '" + filters["imei"] + "'")
+            query.Where("imei = ?", filters["imei"])
         elif filters.get("imeis"):
-            query.Where("imei IN (" + ",".join([self.dbo.q(imei) for imei in filters["imeis"]]) + ")")
+            query.WhereIn("imei", filters["imeis"])
         else:
-            query.Where("project = " + self.dbo.q(project))
+            query.Where("project = ?", project)
 
         if filters.get("search"):
-            searchable = ["imei", "iccid"]
-            search_conditions = (
-                []
-                + [f"{field} LIKE '%{filters['search']}'" for field in searchable]
-                + [f"{field} LIKE '{filters['search']}%'" for field in searchable]
-            )
-            query.Where("(" + " OR ".join(search_conditions) + ")")
+            self.apply_search(query, str(filters["search"]), indexed_search)
+
+    def apply_search(self, query: Query, search: str, indexed_search: bool):
+        # prefix or suffix match on imei / iccid
+        prefix = escape_like(search) + "%"
+        if indexed_search:
+            # suffixes are matched as prefixes of the reversed columns, every branch can use an index
+            fields = SEARCH_FIELDS + [f"{field}_rev" for field in SEARCH_FIELDS]
+            params = [prefix] * len(SEARCH_FIELDS) + [escape_like(search[::-1]) + "%"] * len(SEARCH_FIELDS)
+        else:
+            fields = SEARCH_FIELDS * 2
+            params = [prefix] * len(SEARCH_FIELDS) + ["%" + escape_like(search)] * len(SEARCH_FIELDS)
 
-        self.dbo.execute(query)
-        results = self.dbo.fetch_all()
+        conditions = [f"{field} LIKE ?" for field in fields]
+        query.Where("(" + " OR ".join(conditions) + ")", *params)
 
-        return [Device(**row) for row in results] if results else []
+    async def has_indexed_search(self) -> bool:
+        # the reversed columns come from sql/003, older schemas fall back to the suffix scan
+        columns = await self.dbo.get_table_columns("devices")
+        return all(f"{field}_rev" in columns for field in SEARCH_FIELDS)
 
-    def get_device_by_imei(self, imei: str) -> Device | None:
-        query = Query()
-        query.Select("*").From("devices").Where("imei = " + self.dbo.q(imei))
-        self.dbo.execute(query)
-        result = self.dbo.fetch_one()
+    def to_devices(self, rows: list[dict] | None, fields: list[str]) -> list[Device] | list[dict]:
+        if not rows:
+            return []
+
+        # projected rows are partial, they are returned as plain dicts
+        if fields:
+            return rows
+
+        return [Device(**row) for row in rows]
+
+    async def get_device_by_imei(self, imei: str) -> Device | None:
+        result = await self.dbo.fetch_one(DEVICE_BY_IMEI, imei)
         return Device(**result) if result else None
 
+    async def upsert_devices(self, imeis: list[str], project: str, commit=True) -> int:
+        # relies on the unique index on devices.imei, `created` is only written for new rows
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [{"imei": imei, "project": project, "created": now, "updated": now} for imei in imeis]
+
+        return await self.dbo.bulk_upsert("devices", rows, ["imei"], ["project", "updated"], commit=commit)
+
     async def save_device(self, payload, project):
         if not project or payload.get("imeis") is None:
             raise ValueError("Project name is required when adding devices.")
@@ -52,49 +128,30 @@ class Devices:
         imeis = payload.get("imeis", [])
         if not isinstance(imeis, list):
             imeis = [imei.strip() for imei in imeis.split(",") if imei.strip()]
-        for imei in imeis:
-            existing_device = self.get_device_by_imei(imei)
-            if not existing_device:
-                insert_data = {
-                    "imei": imei,
-                    "project": project,
-                    "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                }
-                self.dbo.insert_object("devices", insert_data)
-            else:
-                update_object = {
-                    "imei": imei,
-                    "project": project,
-                    "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                }
-                self.dbo.update_object("devices", update_object, ["imei"], True)
-
-        self.dbo.commit()
+        await self.upsert_devices(list(dict.fromkeys(imeis)), project, commit=False)
+
+        await self.dbo.commit()
         return True
 
-    def get_imei_by_project(self, project: str) -> list[str]:
+    async def get_imei_by_project(self, project: str) -> list[str]:
         query = Query()
-        query.Select("imei").From("devices").Where("project = " + self.dbo.q(project))
-        self.dbo.execute(query)
-        results = self.dbo.fetch_all()
+        query.Select("imei").From("devices").Where("project = ?", project)
+        results = await self.dbo.fetch_all(query)
         return [row["imei"] for row in results] if results else []
 
-    def check_iccid_exists_by_imei(self, iccid: str, imei) -> bool:
+    async def check_iccid_exists_by_imei(self, iccid: str, imei) -> bool:
         query = Query()
-        query.Select("id").From("devices").Where("iccid = " + self.dbo.q(iccid)).Where("imei = " + self.dbo.q(imei))
-        self.dbo.execute(query)
-        result = self.dbo.fetch_one()
+        query.Select("id").From("devices").Where("iccid = ?", iccid).Where("imei = ?", imei)
+        result = await self.dbo.fetch_one(query)
         return result is not None
 
-    def get_devices_by_project(self, project: str) -> list[Device]:
+    async def get_devices_by_project(self, project: str) -> list[Device]:
         query = Query()
-        query.Select("*").From("devices").Where("project = " + self.dbo.q(project))
-        self.dbo.execute(query)
-        results = self.dbo.fetch_all()
+        query.Select("*").From("devices").Where("project = ?", project)
+        results = await self.dbo.fetch_all(query)
         return [Device(**row) for row in results] if results else []
 
-    async def fetch_new_devices(self, project: str) -> list[Device]:
+    async def fetch_new_devices(self, project: str) -> dict[str, int]:
         # fetch the json data from the platform
         fetch_url = get_config("miwitracker.fetch_device_url")
 
@@ -103,7 +160,8 @@ class Devices:
         }
 
         # set no cert verify
-        response = httpx.post(fetch_url, verify=False, json=data, timeout=10)
+        async with httpx.AsyncClient(verify=False) as client:
+            response = await client.post(fetch_url, json=data, timeout=10)
         if response.status_code != 200:
             raise ValueError("Failed to fetch data from the platform.")
 
@@ -119,38 +177,55 @@ class Devices:
             if imei and isinstance(imei, str) and imei.strip():
                 new_imeis.add(imei.strip())
 
-        # existing IMEIs in the DB for this project
-        existing_imeis = set(self.get_imei_by_project(project))
-
-        # insert or update devices from the fetched list
-        for imei in new_imeis:
-            existing_device = self.get_device_by_imei(imei)
-            if not existing_device:
-                insert_data = {
-                    "imei": imei,
-                    "project": project,
-                    "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                }
-                if self.dbo.insert_object("devices", insert_data):
-                    print(f"Inserted new device with IMEI: {imei}")
-            else:
-                update_object = {
-                    "imei": imei,
-                    "project": project,
-                    "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                }
-                if self.dbo.update_object("devices", update_object, ["imei"], True):
-                    print(f"Updated existing device with IMEI: {imei}")
-
-        # delete devices that exist in DB but were not present in the fetched list
-        to_delete = existing_imeis - new_imeis
-        for imei in to_delete:
+        return await self.sync_project_devices(project, new_imeis)
+
+    async def get_device_projects(self, project: str, imeis: set[str] | list[str]) -> dict[str, str]:
+        # imei => project for the devices of the project plus any of the given imeis
+        chunk_size = int(get_config("database.bulk_chunk_size", 1000))
+
+        query = Query()
+        query.Select(["imei", "project"]).From("devices").Where("project = ?", project)
+        results = await self.dbo.fetch_all(query)
+
+        imeis = list(imeis)
+        for start in range(0, len(imeis), chunk_size):
             query = Query()
-            query.Delete("devices").Where("imei = " + self.dbo.q(imei)).Where("project = " + self.dbo.q(project))
-            self.dbo.execute(query)
-            print(f"Deleted device with IMEI: {imei}")
+            query.Select(["imei", "project"]).From("devices").WhereIn("imei", imeis[start : start + chunk_size])
+            results += await self.dbo.fetch_all(query)
+
+        return {row["imei"]: row["project"] for row in results}
+
+    async def sync_project_devices(self, project: str, imeis: set[str]) -> dict[str, int]:
+        chunk_size = int(get_config("database.bulk_chunk_size", 1000))
+        current = await self.get_device_projects(project, imeis)
+
+        added = imeis - current.keys()
+        changed = {imei for imei in imeis & current.keys() if current[imei] != project}
+        removed = {imei for imei, device_project in current.items() if device_project == project} - imeis
+
+        try:
+            if added or changed:
+                await self.upsert_devices(sorted(added | changed), project, commit=False)
+
+            removed_list = sorted(removed)
+            for start in range(0, len(removed_list), chunk_size):
+                query = Query()
+                query.Delete("devices").Where("project = ?", project)
+                query.WhereIn("imei", removed_list[start : start + chunk_size])
+                await self.dbo.execute(query)
+
+            await self.dbo.commit()
+        except Exception:
+            await self.dbo.rollback()
+            raise
+
+        summary = {
+            "total": len(imeis),
+            "added": len(added),
+            "changed": len(changed),
+            "removed": len(removed),
+            "unchanged": len(imeis) - len(added) - len(changed),
+        }
+        get_logger().info("Synced devices for project %s: %s", project, summary)
 
-        # commit all changes and return current devices for the project
-        self.dbo.commit()
-        return self.get_devices_by_project(project)
+        return summary
@@ -1,34 +1,32 @@
 from app.schema.project import Project
 from app.core import db
-from app.core.db import Database, Query
+from app.core.db import AsyncDatabase, Query
+
+# prebuilt hot lookup, its sql renders once and each call only binds the values
+PROJECT_GROUP_ID = Query().Select("miwi_group_id").From("projects").Where("name = ?")
 
 
 class Projects:
-    def __init__(self, dbo: Database):
+    def __init__(self, dbo: AsyncDatabase):
         self.dbo = dbo
 
-    def get_project_id(self, project_name: str) -> int | None:
+    async def get_project_id(self, project_name: str) -> int | None:
         query = Query()
-        query.Select("id").From("projects").Where("name = " + self.dbo.q(project_name))
-        self.dbo.execute(query)
-        return self.dbo.fetch_result()
+        query.Select("id").From("projects").Where("name = ?", project_name)
+        return await self.dbo.fetch_result(query)
 
-    def get_projects(self) -> list[Project]:
+    async def get_projects(self) -> list[Project]:
         query = Query()
         query.Select("*").From("projects")
-        self.dbo.execute(query)
-        results = self.dbo.fetch_all()
+        results = await self.dbo.fetch_all(query)
 
         return [Project(**row) for row in results] if results else []
 
-    def get_project_group_id(self, project_name: str) -> int | None:
-        query = Query()
-        query.Select("miwi_group_id").From("projects").Where("name = " + self.dbo.q(project_name))
-        self.dbo.execute(query)
-        result = self.dbo.fetch_one()
+    async def get_project_group_id(self, project_name: str) -> int | None:
+        result = await self.dbo.fetch_one(PROJECT_GROUP_ID, project_name)
         return result["miwi_group_id"] if result else None
 
-    def save_projects(self, projects: list[Project]):
+    async def save_projects(self, projects: list[Project]):
         if not projects:
             raise ValueError("No projects to save.")
 
@@ -40,20 +38,20 @@ class Projects:
                     "url": project.url,
                     "miwi_group_id": project.miwi_group_id,
                 }
-                self.dbo.update_object("projects", update_data, "id")
+                await self.dbo.update_object("projects", update_data, "id")
             else:
                 insert_data = {
                     "name": project.name,
                     "url": project.url,
                 }
-                self.dbo.insert_object("projects", insert_data, True)
+                await self.dbo.insert_object("projects", insert_data, True)
 
         return True
 
-    def delete_project(self, project_name: str) -> bool:
+    async def delete_project(self, project_name: str) -> bool:
         query = Query()
-        query.Delete("projects").Where("name = " + self.dbo.q(project_name))
-        self.dbo.execute(query)
-        self.dbo.commit()
+        query.Delete("projects").Where("name = ?", project_name)
+        await self.dbo.execute(query)
+        await self.dbo.commit()
 
         return self.dbo.get_num_rows() > 0
@@ -1,16 +1,97 @@
-from app.core.db import Database, Query
-from app.schema.settings import ProjectSetting, SettingAttributePayload
+import json
+
+from app.config import get_config
+from app.core.cache import TTLCache
+from app.core.db import AsyncDatabase, Query
+from app.core.logger import get_logger
+from app.schema.settings import CommandProfile, ProjectSetting, SettingAttributePayload
+
+# prebuilt hot lookup, its sql renders once and each call only binds the values
+SETTINGS_BY_PROJECT = Query().Select("*").From("project_settings").Where("project_name = ?")
+
+# project name => settings dict (or None), invalidated on save, the ttl covers writes from other workers
+SETTINGS_CACHE = TTLCache("project_settings", ttl=float(get_config("database.settings_cache_ttl", 300)))
+# project name => compiled command profile, dropped together with the settings
+PROFILE_CACHE = TTLCache("command_profiles", ttl=float(get_config("database.settings_cache_ttl", 300)))
+MISSING = object()
+
+DEFAULT_FALL_SENSITIVITY = 8
+DEFAULT_GPS_TRACKING_INTERVAL = "10"
+
+
+def is_empty_value(value: str | None) -> bool:
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
+
+def invalidate_project(project_name: str | None = None):
+    SETTINGS_CACHE.invalidate(project_name)
+    PROFILE_CACHE.invalidate(project_name)
+
+
+def split_numbers(value: str | list | None) -> list[str]:
+    if not value:
+        return []
+
+    values = value if isinstance(value, list) else [value]
+    return [number.strip() for entry in values for number in str(entry).split(",") if number.strip()]
+
+
+def compile_command_profile(project_name: str, settings: dict | None) -> CommandProfile:
+    settings = settings or {}
+    commands = {}
+
+    sos_numbers = split_numbers(settings.get("sos_phone_number"))
+    if sos_numbers:
+        commands["sos"] = ("0001", ",".join(sos_numbers))
+        commands["phone_book"] = ("1106", json.dumps([{"Name": "SOS", "Number": number} for number in sos_numbers]))
+
+    call_center_numbers = split_numbers(settings.get("call_center_number"))
+    if call_center_numbers:
+        commands["call_center"] = ("9602", ",".join(call_center_numbers))
+
+    # the first listed sensitivity level wins
+    sensitivity = split_numbers(settings.get("sensitivity"))
+    level = DEFAULT_FALL_SENSITIVITY
+    if sensitivity:
+        try:
+            level = int(sensitivity[0])
+        except ValueError:
+            # a bad value must not break the other commands of the profile
+            get_logger().warning(
+                f"Invalid fall sensitivity '{sensitivity[0]}' for project {project_name}, "
+                f"using {DEFAULT_FALL_SENSITIVITY}"
+            )
+    commands["fall_alert"] = ("9722", str(level))
+
+    interval = settings.get("gps_tracking_interval") or DEFAULT_GPS_TRACKING_INTERVAL
+    commands["gpstrack"] = ("0305", str(interval))
+
+    return CommandProfile(project_name=project_name, commands=commands)
 
 
 class Settings:
-    def __init__(self, dbo: Database):
+    def __init__(self, dbo: AsyncDatabase):
         self.dbo = dbo
 
-    def get_by_project(self, project_name: str) -> dict | None:
-        query = Query()
-        query.Select("*").From("project_settings").Where("project_name = " + self.dbo.q(project_name))
-        self.dbo.execute(query)
-        result = self.dbo.fetch_all()
+    async def get_by_project(self, project_name: str) -> dict | None:
+        settings = SETTINGS_CACHE.get(project_name, MISSING)
+        if settings is MISSING:
+            settings = await self.load_by_project(project_name)
+            SETTINGS_CACHE.set(project_name, settings)
+
+        # callers get their own copy of the shared dict
+        return dict(settings) if settings else None
+
+    async def get_command_profile(self, project_name: str) -> CommandProfile:
+        profile = PROFILE_CACHE.get(project_name)
+        if profile is None:
+            profile = compile_command_profile(project_name, await self.get_by_project(project_name))
+            PROFILE_CACHE.set(project_name, profile)
+
+        return profile
+
+    async def load_by_project(self, project_name: str) -> dict | None:
+        result = await self.dbo.fetch_all(SETTINGS_BY_PROJECT, project_name)
 
         if result:
             settings = [ProjectSetting(**setting) for setting in result]
@@ -18,35 +99,57 @@ class Settings:
 
         return None
 
-    def update_form_value(self, project_name: str, field: str, value: str | None = None) -> list[str]:
-        if value is None or (isinstance(value, str) and value.strip() == ""):
-            query = Query()
-            query.Delete("project_settings").Where("project_name = " + self.dbo.q(project_name)).Where(
-                "field = " + self.dbo.q(field)
-            )
-            self.dbo.execute(str(query))
-            self.dbo.commit()
-            return True
+    async def update_form_value(self, project_name: str, field: str, value: str | None = None) -> list[str]:
+        try:
+            if is_empty_value(value):
+                query = Query()
+                query.Delete("project_settings").Where("project_name = ?", project_name).Where("field = ?", field)
+                await self.dbo.execute(query)
+                await self.dbo.commit()
+                return True
 
-        else:
-            record = ProjectSetting(field=field, value=value, project_name=project_name)
-            self.dbo.insert_object("project_settings", record.model_dump(db_fields=True), True)
+            else:
+                record = ProjectSetting(field=field, value=value, project_name=project_name)
+                await self.dbo.insert_object("project_settings", record.model_dump(db_fields=True), True)
+        finally:
+            # after the write, a reload while it was in flight would have cached the old rows
+            invalidate_project(project_name)
 
         return True
 
-    def save(self, project_name: str, attributes: list[SettingAttributePayload]) -> list[str]:
-        existing_settings = self.get_by_project(project_name)
-        existing_settings = existing_settings.keys() if existing_settings else []
+    async def save(self, project_name: str, attributes: list[SettingAttributePayload]) -> list[str]:
+        existing_settings = await self.load_by_project(project_name) or {}
+        incoming = {attr.key: attr.value for attr in attributes}
 
-        saved_fields = []
+        # empty values remove the field, same as update_form_value
+        changed = {
+            field: value
+            for field, value in incoming.items()
+            if not is_empty_value(value) and existing_settings.get(field) != value
+        }
+        removed = [field for field in existing_settings if field not in incoming or is_empty_value(incoming[field])]
 
-        for attr in attributes:
-            self.update_form_value(project_name, attr.key, attr.value)
-            saved_fields.append(attr.key)
+        if not changed and not removed:
+            return []
 
-        # Remove settings that are not in the new attributes
-        for field in existing_settings:
-            if field not in saved_fields:
-                self.update_form_value(project_name, field, None)
+        try:
+            if changed:
+                rows = [
+                    ProjectSetting(field=field, value=value, project_name=project_name).model_dump(db_fields=True)
+                    for field, value in changed.items()
+                ]
+                await self.dbo.bulk_replace("project_settings", rows, commit=False)
 
-        return True
+            if removed:
+                query = Query()
+                query.Delete("project_settings").Where("project_name = ?", project_name).WhereIn("field", removed)
+                await self.dbo.execute(query)
+
+            await self.dbo.commit()
+        except Exception:
+            await self.dbo.rollback()
+            raise
+        finally:
+            invalidate_project(project_name)
+
+        return [*changed, *removed]
@@ -2,31 +2,51 @@ from typing import Any
 
 from fastapi import APIRouter, Body, Depends
 
-from app.core.db import Database, get_dbo
+from app.core.db import AsyncDatabase, get_dbo
+from app.core.logger import get_logger
 from app.core.miwi import Miwi
 from app.models.devices import Devices
+from app.schema.device import BulkCommandPayload
 from app.schema.response import ResponsePayload
 
 router = APIRouter(prefix="/devices")
 
 
 @router.post("/task/check-online")
-async def check_online(dbo: Database = Depends(get_dbo), body: dict[str, Any] = Body(...)):
+async def check_online(dbo: AsyncDatabase = Depends(get_dbo), body: dict[str, Any] = Body(...)):
     imeis = body.get("imeis")
     if imeis is None or len(imeis) == 0:
         return ResponsePayload(success=False, message="No imeis provided")
 
     miwi = Miwi(dbo)
-    result = await miwi.check_onlines(imeis.split(","))
-    print(f"check_online result:", result)
-    
-    
+    result = await miwi.check_onlines(imeis.split(","), refresh=bool(body.get("refresh")))
+    get_logger().debug("check_online result: %s", result)
+
+    return ResponsePayload(success=True, data=result)
+
+
+@router.post("/task/bulk")
+async def bulk_command(dbo: AsyncDatabase = Depends(get_dbo), payload: BulkCommandPayload = Body(...)):
+    imeis = payload.imeis or []
+    if isinstance(imeis, str):
+        imeis = [imei.strip() for imei in imeis.split(",") if imei.strip()]
+
+    if not imeis and payload.project:
+        imeis = await Devices(dbo).get_imei_by_project(payload.project)
+
+    if not imeis:
+        return ResponsePayload(success=False, message="No imeis provided")
+
+    miwi = Miwi(dbo, payload.force)
+    result = await miwi.send_bulk(
+        payload.command, list(dict.fromkeys(imeis)), payload.project or "", payload.concurrency, payload.timeout
+    )
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/locate/{imei}")
-async def locate(dbo: Database = Depends(get_dbo), imei=""):
+async def locate(dbo: AsyncDatabase = Depends(get_dbo), imei=""):
     miwi = Miwi(dbo)
     result = await miwi.locate(imei)
 
@@ -34,47 +54,47 @@ async def locate(dbo: Database = Depends(get_dbo), imei=""):
 
 
 @router.post("/task/setphonebook/{imei}")
-async def set_book_phone(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def set_book_phone(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_phone_book(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/setblockphone/{imei}")
-async def setblockphone(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def setblockphone(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_block_phone(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/setsos/{imei}")
-async def setsos(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def setsos(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_sos(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/sethealth/{imei}")
-async def sethealth(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def sethealth(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_health(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/setcallcenter/{imei}")
-async def setcallcenter(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def setcallcenter(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_call_center(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/reboot/{imei}")
-async def reboot(dbo: Database = Depends(get_dbo), imei=""):
+async def reboot(dbo: AsyncDatabase = Depends(get_dbo), imei=""):
     miwi = Miwi(dbo)
     result = await miwi.reboot(imei)
 
@@ -82,7 +102,7 @@ async def reboot(dbo: Database = Depends(get_dbo), imei=""):
 
 
 @router.post("/task/poweroff/{imei}")
-async def power_off(dbo: Database = Depends(get_dbo), imei=""):
+async def power_off(dbo: AsyncDatabase = Depends(get_dbo), imei=""):
     miwi = Miwi(dbo)
     result = await miwi.power_off(imei)
 
@@ -90,44 +110,44 @@ async def power_off(dbo: Database = Depends(get_dbo), imei=""):
 
 
 @router.post("/task/setfallalert/{imei}/{project}")
-async def set_fall_alert(dbo: Database = Depends(get_dbo), imei="", project=""):
-    miwi = Miwi(dbo)
+async def set_fall_alert(dbo: AsyncDatabase = Depends(get_dbo), imei="", project="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.set_fall_alert(imei, project)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/task/offfallalert/{imei}/")
-async def off_fall_alert(dbo: Database = Depends(get_dbo), imei=""):
-    miwi = Miwi(dbo)
+async def off_fall_alert(dbo: AsyncDatabase = Depends(get_dbo), imei="", force: bool = False):
+    miwi = Miwi(dbo, force)
     result = await miwi.off_fall_alert(imei)
 
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/save/{project}")
-async def save_device(dbo: Database = Depends(get_dbo), project="", payload: dict[str, Any] = Body(...)):
+async def save_device(dbo: AsyncDatabase = Depends(get_dbo), project="", payload: dict[str, Any] = Body(...)):
     device = Devices(dbo)
     result = await device.save_device(payload, project)
     return ResponsePayload(success=True, data=result)
 
 
 @router.get("/updateICCID/get_devices")
-async def update_iccid(dbo: Database = Depends(get_dbo), miwi_group_id=None):
+async def update_iccid(dbo: AsyncDatabase = Depends(get_dbo), miwi_group_id=None):
     miwi = Miwi(dbo)
     result = await miwi.update_iccid(miwi_group_id)
     return ResponsePayload(success=True, data=result)
 
 
 @router.get("/addupdateGroupId/{project}")
-async def add_update_group_id(dbo: Database = Depends(get_dbo), project=""):
+async def add_update_group_id(dbo: AsyncDatabase = Depends(get_dbo), project=""):
     miwi = Miwi(dbo)
     result = await miwi.update_group_and_iccid(project)
     return ResponsePayload(success=True, data=result)
 
 
 @router.get("/fetchNewDevices/{project}")
-async def fetch_new_devices(project="", dbo: Database = Depends(get_dbo)):
+async def fetch_new_devices(project="", dbo: AsyncDatabase = Depends(get_dbo)):
     if not project:
         return ResponsePayload(success=False, message="Project name is required.")
 
@@ -139,10 +159,23 @@ async def fetch_new_devices(project="", dbo: Database = Depends(get_dbo)):
 @router.get("/{project}")
 @router.post("/{project}")
 @router.post("/")
-async def get_devices(dbo: Database = Depends(get_dbo), project="", body: dict[str, Any] | None = Body(default=None)):
+async def get_devices(
+    dbo: AsyncDatabase = Depends(get_dbo),
+    project="",
+    body: dict[str, Any] | None = Body(default=None),
+    limit: int | None = None,
+    after: int | None = None,
+    fields: str | None = None,
+    total: bool = False,
+):
     devices = Devices(dbo)
 
-    filters = body.get("filters") if body else None
-    data = devices.get_devices(project, filters or {})
+    filters = dict(body.get("filters") or {}) if body else {}
+    # pagination can also be passed in the query string, the body filters win
+    for key, value in {"limit": limit, "after": after, "fields": fields, "total": total}.items():
+        if value and key not in filters:
+            filters[key] = value
+
+    data = await devices.get_devices(project, filters)
 
     return ResponsePayload(success=True, data=data)
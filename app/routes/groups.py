@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Body, Depends
 from pydantic import ValidationError
 
-from app.core.db import Database, get_dbo
+from app.core.db import AsyncDatabase, get_dbo
 from app.core.miwi import Miwi
 from app.schema.group import GroupCreatePayload
 from app.schema.response import ResponsePayload
@@ -11,14 +11,14 @@ router = APIRouter(prefix="/groups")
 
 @router.get("/")
 @router.post("/")
-async def get_group_list(dbo: Database = Depends(get_dbo)):
+async def get_group_list(dbo: AsyncDatabase = Depends(get_dbo)):
     miwi = Miwi(dbo)
     result = await miwi.get_group_list()
     return ResponsePayload(success=True, data=result)
 
 
 @router.post("/create")
-async def create_group(dbo: Database = Depends(get_dbo), payload: GroupCreatePayload = Body(...)):
+async def create_group(dbo: AsyncDatabase = Depends(get_dbo), payload: GroupCreatePayload = Body(...)):
     if payload.group_name:
         miwi = Miwi(dbo)
         result = await miwi.create_group(payload.group_name, payload.description)
@@ -28,7 +28,7 @@ async def create_group(dbo: Database = Depends(get_dbo), payload: GroupCreatePay
 
 
 @router.delete("/{gid}")
-async def delete_group(dbo: Database = Depends(get_dbo), gid=0):
+async def delete_group(dbo: AsyncDatabase = Depends(get_dbo), gid=0):
     miwi = Miwi(dbo)
     result = await miwi.delete_group(gid)
     return ResponsePayload(success=True, data=result)
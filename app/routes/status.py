@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends
+
+from app.core.db import CONNECTION_POOLS, AsyncDatabase, get_dbo
+from app.core.limits import LIMITERS
+from app.core.metrics import MIWI_COMMANDS
+from app.core.outbox import get_outbox
+from app.core.resilience import BREAKERS
+from app.schema.response import ResponsePayload
+
+router = APIRouter(prefix="/status")
+
+
+@router.get("/pool")
+async def get_pool_stats():
+    data = [pool.stats() for pool in CONNECTION_POOLS.values()]
+
+    return ResponsePayload(success=True, data=data)
+
+
+@router.get("/outbox")
+async def get_outbox_stats(dbo: AsyncDatabase = Depends(get_dbo)):
+    outbox = get_outbox()
+    data = outbox.stats()
+    if outbox.enabled:
+        data["depth"] = await outbox.depth(dbo)
+
+    return ResponsePayload(success=True, data=data)
+
+
+@router.get("/limits")
+async def get_limiter_stats():
+    data = [limiter.stats() for limiter in LIMITERS.values()]
+
+    return ResponsePayload(success=True, data=data)
+
+
+@router.get("/upstream")
+async def get_upstream_stats():
+    data = [breaker.stats() for breaker in BREAKERS.values()]
+
+    return ResponsePayload(success=True, data=data)
+
+
+@router.get("/commands")
+async def get_command_stats():
+    return ResponsePayload(success=True, data={result: MIWI_COMMANDS.get(result) for result in ("sent", "skipped")})
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.schema.base import MySQLDateTime
 
@@ -13,3 +13,12 @@ class Device(BaseModel):
     phone_number: str | None = None
     created: MySQLDateTime
     updated: MySQLDateTime | None = None
+
+
+class BulkCommandPayload(BaseModel):
+    command: str
+    imeis: list[str] | str | None = None
+    project: str | None = None
+    concurrency: int | None = Field(default=None, ge=1, le=200)
+    timeout: float | None = Field(default=None, gt=0)
+    force: bool = False
@@ -17,6 +17,10 @@ class AppException(Exception):
         return d
 
 
+class BadRequestError(AppException):
+    status = 400
+
+
 class NotFoundError(AppException):
     status = 404
 
@@ -26,3 +30,11 @@ class DatabaseError(AppException):
 
     def __init__(self, detail=None, **kwargs):
         super().__init__(detail=detail or "Database error occurred", **kwargs)
+
+
+class UpstreamError(AppException):
+    status = 502
+
+
+class UpstreamUnavailable(UpstreamError):
+    status = 503
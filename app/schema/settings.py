@@ -1,4 +1,5 @@
 import json
+from datetime import datetime
 
 from pydantic import BaseModel, ConfigDict
 
@@ -39,3 +40,16 @@ class SettingAttributePayload(BaseModel):
 class SettingPayload(BaseModel):
     project: str
     attributes: list[SettingAttributePayload]
+
+
+class CommandProfile(BaseModel):
+    project_name: str
+    # command name => ready to send (CommandCode, CommandValue)
+    commands: dict[str, tuple[str, str]] = {}
+
+    def payload(self, command: str, imei: str) -> dict | None:
+        if command not in self.commands:
+            return None
+
+        code, value = self.commands[command]
+        return {"Imei": imei, "timestamp": datetime.now().isoformat(), "CommandCode": code, "CommandValue": value}
@@ -0,0 +1,69 @@
+"""
+Compare blocking and thread-pool database access under parallel load.
+
+Every simulated request opens a connection and runs `SELECT SLEEP(x)`, once through the blocking
+`Database` (as the route handlers used to) and once through `AsyncDatabase`.
+Needs the MariaDB server configured in config.ini.
+
+    python -m benchmarks.db_concurrency --requests 200 --concurrency 20 --sleep 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from app.core.db import AsyncDatabase, Database
+
+
+async def blocking_request(sleep: float):
+    dbo = Database()
+    try:
+        dbo.execute("SELECT SLEEP(?)", sleep)
+        dbo.fetch_result()
+    finally:
+        dbo.close()
+
+
+async def async_request(sleep: float):
+    dbo = await AsyncDatabase.connect()
+    try:
+        await dbo.fetch_result("SELECT SLEEP(?)", sleep)
+    finally:
+        await dbo.close()
+
+
+async def run(mode: str, requests: int, concurrency: int, sleep: float) -> dict:
+    handler = blocking_request if mode == "blocking" else async_request
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(sleep)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed": round(elapsed, 4),
+        "throughput": round(requests / elapsed, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sleep", type=float, default=0.02)
+    args = parser.parse_args()
+
+    for mode in ("blocking", "async"):
+        print(json.dumps(await run(mode, args.requests, args.concurrency, args.sleep)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
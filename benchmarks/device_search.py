@@ -0,0 +1,105 @@
+"""
+Compare the device search on a synthetic table, suffix LIKE scans against the reversed column indexes.
+
+Creates `bench_devices` (same search columns and indexes as sql/003), fills it with synthetic devices and
+times the conditions `Devices.apply_search` generates in both modes, with the rows EXPLAIN expects to read.
+Needs the MariaDB server configured in config.ini.
+
+    python -m benchmarks.device_search --rows 100000 --repeat 20
+"""
+
+import argparse
+import json
+import random
+import time
+
+from app.core.db import Database
+from app.core.query import Query
+from app.models.devices import Devices
+
+TABLE = "bench_devices"
+
+
+def create_table(dbo: Database, rows: int):
+    dbo.execute(f"DROP TABLE IF EXISTS `{TABLE}`")
+    dbo.execute(
+        f"""CREATE TABLE `{TABLE}` (
+            `id` INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            `project` VARCHAR(64) NOT NULL,
+            `imei` VARCHAR(32) NOT NULL,
+            `iccid` VARCHAR(32) NULL,
+            `imei_rev` VARCHAR(64) AS (REVERSE(`imei`)) PERSISTENT,
+            `iccid_rev` VARCHAR(64) AS (REVERSE(`iccid`)) PERSISTENT,
+            UNIQUE KEY `uq_imei` (`imei`),
+            KEY `idx_iccid` (`iccid`),
+            KEY `idx_imei_rev` (`imei_rev`),
+            KEY `idx_iccid_rev` (`iccid_rev`)
+        )"""
+    )
+
+    values = [(f"project-{i % 50}", f"86{i:013d}", f"8985{random.randrange(10**15, 10**16)}") for i in range(rows)]
+    for start in range(0, rows, 5000):
+        dbo.csr.executemany(
+            f"INSERT INTO `{TABLE}` (`project`, `imei`, `iccid`) VALUES (?, ?, ?)", values[start : start + 5000]
+        )
+    dbo.commit()
+    dbo.execute(f"ANALYZE TABLE `{TABLE}`")
+    dbo.fetch_all()
+
+    return values
+
+
+def search_query(search: str, indexed: bool) -> Query:
+    query = Query()
+    query.Select("id").From(TABLE)
+    Devices(None).apply_search(query, search, indexed)
+
+    return query
+
+
+def run(dbo: Database, search: str, indexed: bool, repeat: int) -> dict:
+    query = search_query(search, indexed)
+
+    dbo.execute("EXPLAIN " + str(query), *query.params)
+    plan = dbo.fetch_all()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        dbo.execute(query)
+        matches = len(dbo.fetch_all() or [])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": "indexed" if indexed else "scan",
+        "search": search,
+        "matches": matches,
+        "explain_rows": sum(int(row.get("rows") or 0) for row in plan),
+        "explain_type": ",".join(str(row.get("type")) for row in plan),
+        "avg_ms": round(elapsed / repeat * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic table")
+    args = parser.parse_args()
+
+    dbo = Database()
+    try:
+        values = create_table(dbo, args.rows)
+        sample = random.choice(values)
+        # imei prefix, imei suffix and iccid suffix lookups
+        searches = [sample[1][:8], sample[1][-6:], sample[2][-6:]]
+
+        results = [run(dbo, search, indexed, args.repeat) for search in searches for indexed in (False, True)]
+        print(json.dumps({"rows": args.rows, "results": results}, indent=2))
+    finally:
+        if not args.keep:
+            dbo.execute(f"DROP TABLE IF EXISTS `{TABLE}`")
+        dbo.close()
+
+
+if __name__ == "__main__":
+    main()
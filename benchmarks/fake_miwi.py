@@ -0,0 +1,123 @@
+"""
+Local stand-in for the Miwi open api (and the platform `fetchNewDevices` feed) for load tests.
+
+Serves `get_token`, `get_devicelist` / `getdevicelistbygroup`, `sendcommand` and the `organgroups` routes
+for a synthetic fleet, with a configurable latency, jitter, error rate (HTTP 500) and share of offline devices.
+`GET /_stats` returns the calls per route since start or the last `POST /_reset`.
+
+    python -m benchmarks.fake_miwi --port 8802 --devices 1000 --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+import uvicorn
+from fastapi import Body, FastAPI, Request
+from fastapi.responses import JSONResponse
+
+GROUP_ID = 1
+
+
+def device_imei(index: int) -> str:
+    return f"86{index:013d}"
+
+
+def create_app(
+    devices: int, project: str, latency: float, jitter: float, error_rate: float, offline_rate: float, seed: int
+) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    calls = Counter()
+
+    fleet = [
+        {
+            "Imei": device_imei(index),
+            "Imsi": f"8985{index:015d}",
+            "DeviceName": f"bench-{index}",
+            "Status": 0 if rng.random() < offline_rate else 1,
+            "GroupId": GROUP_ID,
+        }
+        for index in range(devices)
+    ]
+    online = {device["Imei"]: device["Status"] == 1 for device in fleet}
+    groups = [{"GroupId": GROUP_ID, "GroupName": project, "Description": ""}]
+
+    @app.middleware("http")
+    async def upstream_behaviour(request: Request, call_next):
+        route = request.url.path.rstrip("/").rsplit("/", 1)[-1].lower()
+        if route.startswith("_"):
+            return await call_next(request)
+
+        calls[route] += 1
+        await asyncio.sleep(max(0.0, rng.gauss(latency, jitter)))
+        if rng.random() < error_rate:
+            calls[f"{route}_error"] += 1
+            return JSONResponse({"Code": 500, "Message": "Injected upstream error"}, status_code=500)
+
+        return await call_next(request)
+
+    @app.post("/api/token/get_token")
+    async def get_token():
+        return {"Code": 0, "Result": {"AccessToken": "bench-token"}}
+
+    @app.post("/api/devicelist/get_devicelist")
+    @app.post("/api/devicelist/getdevicelistbygroup")
+    async def get_devicelist():
+        return {"Code": 0, "Result": fleet}
+
+    @app.post("/api/command/sendcommand")
+    async def sendcommand(payload: dict = Body(...)):
+        if not online.get(payload.get("Imei")):
+            return {"Code": 1800, "Message": "Device is offline"}
+
+        return {"Code": 0, "Message": "Success"}
+
+    @app.post("/api/organgroups/getorgangroupsinfolist")
+    async def getorgangroupsinfolist():
+        return {"Code": 0, "Item": groups}
+
+    @app.post("/api/organgroups/addorgangroupsinfo")
+    @app.post("/api/organgroups/movedevicestoorgangroups")
+    @app.post("/api/organgroups/delorgangroupsinfo")
+    async def organgroups():
+        return {"Code": 0, "Message": "Success"}
+
+    @app.post("/platform/fetchNewDevices")
+    async def fetch_new_devices():
+        return {"success": True, "data": {device["Imei"]: device["DeviceName"] for device in fleet}}
+
+    @app.get("/_stats")
+    async def stats():
+        return dict(calls)
+
+    @app.post("/_reset")
+    async def reset():
+        calls.clear()
+        return {}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8802)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--project", default="bench")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with HTTP 500")
+    parser.add_argument("--offline-rate", type=float, default=0.1, help="share of offline devices")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_app(
+        args.devices, args.project, args.latency, args.jitter, args.error_rate, args.offline_rate, args.seed
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
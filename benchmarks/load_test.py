@@ -0,0 +1,329 @@
+"""
+End-to-end load test of `app.main:server` against the local Miwi stand-in (benchmarks.fake_miwi).
+
+Starts the fake Miwi api and the app with uvicorn, each in its own process. The app is pointed at the fake through
+an override ini passed in `MIWI_CONFIG`. The harness seeds a project with the fake fleet and drives request mixes
+at each concurrency level. It writes one JSON record per (mix, concurrency) with throughput, p50/p95/p99 latency,
+errors and the upstream calls per Miwi route. `--baseline` compares the run against an earlier `--output` file.
+Needs a MariaDB server with the app schema, configured in config.ini or in an ini passed with `--config`.
+
+    python -m benchmarks.load_test --mixes mixed,check_online --concurrency 1,10,50 --duration 15 \\
+        --output bench.json --baseline previous.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks.fake_miwi import GROUP_ID, device_imei
+
+# mix name => operation => weight
+MIXES = {
+    "check_online": {"check_online": 1},
+    "bulk_setsos": {"bulk_setsos": 1},
+    "listing": {"list_devices": 1},
+    "fetch_new_devices": {"fetch_new_devices": 1},
+    "mixed": {"check_online": 50, "list_devices": 35, "bulk_setsos": 10, "fetch_new_devices": 5},
+}
+
+
+def build_request(operation: str, rng: random.Random, args) -> tuple[str, str, dict]:
+    imeis = [device_imei(index) for index in rng.sample(range(args.devices), min(args.batch, args.devices))]
+
+    if operation == "check_online":
+        return "POST", "/devices/task/check-online", {"json": {"imeis": ",".join(imeis)}}
+    if operation == "bulk_setsos":
+        return "POST", "/devices/task/bulk", {"json": {"command": "setsos", "imeis": imeis, "project": args.project}}
+    if operation == "list_devices":
+        return "GET", f"/devices/{args.project}", {"params": {"limit": args.page_size}}
+    if operation == "fetch_new_devices":
+        return "GET", f"/devices/fetchNewDevices/{args.project}", {}
+
+    raise ValueError(f"Unknown operation '{operation}'.")
+
+
+def write_override(args, path: str):
+    miwi_url = f"http://127.0.0.1:{args.miwi_port}"
+    # pinned, otherwise repeated setsos calls measure the unchanged skip and depend on leftover database state
+    skip_unchanged = int(args.skip_unchanged)
+    with open(path, "w") as file:
+        file.write(
+            f"""[miwitracker]
+api_endpoint={miwi_url}
+fetch_device_url={miwi_url}/platform/fetchNewDevices
+user_id=bench
+http2=0
+skip_unchanged={skip_unchanged}
+
+[outbox]
+enabled=0
+
+[logging]
+level=WARNING
+console=0
+"""
+        )
+
+
+def seed(args):
+    # imported here, the app config is read on first use and MIWI_CONFIG has to be set by then
+    from app.core.db import Database
+    from app.core.query import Query
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    dbo = Database()
+    try:
+        query = Query()
+        query.Select("id").From("projects").Where("name = ?", args.project)
+        dbo.execute(query)
+        if dbo.fetch_one():
+            dbo.update_object("projects", {"name": args.project, "miwi_group_id": GROUP_ID}, "name")
+        else:
+            dbo.insert_object("projects", {"name": args.project, "url": "", "miwi_group_id": GROUP_ID})
+
+        rows = [
+            {"project": args.project, "imei": device_imei(index), "miwi_group_id": GROUP_ID, "created": now}
+            for index in range(args.devices)
+        ]
+        dbo.bulk_upsert("devices", rows, "imei", ["project", "miwi_group_id"])
+    finally:
+        dbo.close()
+
+
+def start_process(module: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *module], env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+def percentiles(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float | None:
+        if not latencies:
+            return None
+
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+    return {
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+async def run_level(app: httpx.AsyncClient, miwi: httpx.AsyncClient, mix: str, concurrency: int, args) -> dict:
+    operations = list(MIXES[mix])
+    weights = list(MIXES[mix].values())
+    # operation => [latencies, errors]
+    samples = {operation: [[], 0] for operation in operations}
+
+    async def worker(index: int, deadline: float, record: bool):
+        rng = random.Random(f"{args.seed}-{mix}-{concurrency}-{index}")
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            method, url, kwargs = build_request(operation, rng, args)
+
+            start = time.perf_counter()
+            try:
+                response = await app.request(method, url, **kwargs)
+                failed = response.status_code != 200 or not response.json().get("success")
+            except httpx.HTTPError:
+                failed = True
+            elapsed = time.perf_counter() - start
+
+            if record:
+                samples[operation][0].append(elapsed)
+                samples[operation][1] += int(failed)
+
+    if args.warmup > 0:
+        deadline = time.monotonic() + args.warmup
+        await asyncio.gather(*[worker(index, deadline, False) for index in range(concurrency)])
+
+    await miwi.post("/_reset")
+    start = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*[worker(index, deadline, True) for index in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    upstream = (await miwi.get("/_stats")).json()
+
+    latencies = [latency for operation_latencies, _ in samples.values() for latency in operation_latencies]
+    return {
+        "mix": mix,
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in samples.values()),
+        "throughput": round(len(latencies) / elapsed, 2),
+        **percentiles(latencies),
+        "operations": {
+            operation: {"requests": len(operation_latencies), "errors": errors, **percentiles(operation_latencies)}
+            for operation, (operation_latencies, errors) in samples.items()
+        },
+        "upstream_calls": upstream,
+    }
+
+
+def compare(results: list[dict], baseline_path: str) -> list[dict]:
+    with open(baseline_path) as file:
+        baseline = {(result["mix"], result["concurrency"]): result for result in json.load(file)["results"]}
+
+    def change(current, previous):
+        if not current or not previous:
+            return None
+
+        return round((current - previous) / previous * 100, 1)
+
+    changes = []
+    for result in results:
+        previous = baseline.get((result["mix"], result["concurrency"]))
+        if not previous:
+            continue
+
+        changes.append(
+            {
+                "mix": result["mix"],
+                "concurrency": result["concurrency"],
+                "throughput_change_pct": change(result["throughput"], previous["throughput"]),
+                "p95_change_pct": change(result["p95_ms"], previous["p95_ms"]),
+                "p99_change_pct": change(result["p99_ms"], previous["p99_ms"]),
+            }
+        )
+
+    return changes
+
+
+async def run(args) -> list[dict]:
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 10)
+    results = []
+
+    async with (
+        httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as app,
+        httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.miwi_port}") as miwi,
+    ):
+        await wait_ready(miwi, "/_stats")
+        await wait_ready(app, "/metrics")
+
+        # the command profile of the project needs an sos number for setsos
+        settings = {"project": args.project, "attributes": [{"key": "sos_phone_number", "value": "85212345678"}]}
+        await app.post("/settings/saveConfig", json=settings)
+
+        for mix in args.mixes:
+            for concurrency in args.concurrency:
+                result = await run_level(app, miwi, mix, concurrency, args)
+                print(json.dumps(result), flush=True)
+                results.append(result)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mixes", default="mixed", help=f"comma separated, of {', '.join(MIXES)}")
+    parser.add_argument("--concurrency", default="1,10,50", help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before each level")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50, help="imeis per check-online / bulk request")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--project", default="bench")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds per Miwi call")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--offline-rate", type=float, default=0.1)
+    parser.add_argument("--app-port", type=int, default=8801)
+    parser.add_argument("--miwi-port", type=int, default=8802)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the app")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--skip-unchanged", action="store_true", help="let the app skip setting commands already applied"
+    )
+    parser.add_argument("--config", default="", help="extra ini applied after the benchmark overrides")
+    parser.add_argument("--output", default="", help="write the results as one JSON document")
+    parser.add_argument("--baseline", default="", help="an earlier --output file to compare against")
+    args = parser.parse_args()
+
+    args.mixes = [mix.strip() for mix in args.mixes.split(",") if mix.strip()]
+    for mix in args.mixes:
+        if mix not in MIXES:
+            parser.error(f"unknown mix '{mix}'")
+    args.concurrency = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        override = os.path.join(tmp, "bench.ini")
+        write_override(args, override)
+        env = {**os.environ, "MIWI_CONFIG": os.pathsep.join(path for path in (override, args.config) if path)}
+        os.environ["MIWI_CONFIG"] = env["MIWI_CONFIG"]
+
+        seed(args)
+
+        processes = [
+            start_process(
+                [
+                    "benchmarks.fake_miwi",
+                    *("--port", str(args.miwi_port), "--devices", str(args.devices), "--project", args.project),
+                    *("--latency", str(args.latency), "--jitter", str(args.jitter)),
+                    *("--error-rate", str(args.error_rate), "--offline-rate", str(args.offline_rate)),
+                    *("--seed", str(args.seed)),
+                ],
+                env,
+            ),
+            start_process(
+                [
+                    "uvicorn",
+                    "app.main:server",
+                    *("--host", "127.0.0.1", "--port", str(args.app_port), "--workers", str(args.workers)),
+                    *("--log-level", "warning", "--no-access-log"),
+                ],
+                env,
+            ),
+        ]
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.baseline:
+        report["baseline"] = args.baseline
+        report["changes"] = compare(results, args.baseline)
+        for change in report["changes"]:
+            print(json.dumps(change))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
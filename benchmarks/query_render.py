@@ -0,0 +1,64 @@
+"""
+Microbenchmark of the Query builder on the shapes of the hot lookups.
+
+`render` rebuilds the sql string every time (the previous behaviour of `str(query)`), `cached` goes through
+the shape keyed SQL_CACHE, `template` reuses one prebuilt query and only binds the values.
+
+    python -m benchmarks.query_render --number 100000
+"""
+
+import argparse
+import copy
+import json
+import timeit
+
+from app.core.query import Query
+
+
+def device_by_imei(imei: str) -> Query:
+    return Query().Select("*").From("devices").Where("imei = ?", imei)
+
+
+def settings_by_project(project: str) -> Query:
+    return Query().Select("*").From("project_settings").Where("project_name = ?", project)
+
+
+def project_group_id(project: str) -> Query:
+    return Query().Select("miwi_group_id").From("projects").Where("name = ?", project)
+
+
+SHAPES = {
+    "get_device_by_imei": device_by_imei,
+    "get_by_project": settings_by_project,
+    "get_project_group_id": project_group_id,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = []
+    for name, build in SHAPES.items():
+        template = build("")
+        str(template)
+
+        timings = {
+            "render": timeit.timeit(lambda build=build: build("123456789012345").render(), number=args.number),
+            "cached": timeit.timeit(lambda build=build: str(build("123456789012345")), number=args.number),
+            "template": timeit.timeit(
+                lambda template=template: (str(template), ["123456789012345"]), number=args.number
+            ),
+            "deepcopy": timeit.timeit(lambda template=template: copy.deepcopy(template), number=args.number),
+        }
+
+        result = {"query": name, "number": args.number}
+        result.update({f"{key}_us": round(value / args.number * 1e6, 3) for key, value in timings.items()})
+        results.append(result)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+-- Devices.upsert_devices writes with INSERT ... ON DUPLICATE KEY UPDATE, which needs imei to be unique.
+-- Remove duplicated imei rows before running this.
+ALTER TABLE `devices` ADD UNIQUE INDEX IF NOT EXISTS `uq_devices_imei` (`imei`);
@@ -0,0 +1,2 @@
+-- Devices.get_devices pages a project with WHERE project = ? AND id > ? ORDER BY id, served by this index.
+ALTER TABLE `devices` ADD INDEX IF NOT EXISTS `idx_devices_project_id` (`project`, `id`);
@@ -0,0 +1,8 @@
+-- Devices.get_devices serves suffix searches as prefix matches on the reversed imei / iccid.
+-- The columns are generated by the server, inserts and updates keep them in sync without application code.
+ALTER TABLE `devices`
+    ADD COLUMN IF NOT EXISTS `imei_rev` VARCHAR(64) AS (REVERSE(`imei`)) PERSISTENT,
+    ADD COLUMN IF NOT EXISTS `iccid_rev` VARCHAR(64) AS (REVERSE(`iccid`)) PERSISTENT,
+    ADD INDEX IF NOT EXISTS `idx_devices_iccid` (`iccid`),
+    ADD INDEX IF NOT EXISTS `idx_devices_imei_rev` (`imei_rev`),
+    ADD INDEX IF NOT EXISTS `idx_devices_iccid_rev` (`iccid_rev`);
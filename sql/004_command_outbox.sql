@@ -0,0 +1,19 @@
+-- Commands held for offline devices, drained by the outbox workers (app/core/outbox.py).
+CREATE TABLE IF NOT EXISTS `command_outbox` (
+    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    `imei` VARCHAR(32) NOT NULL,
+    `command_code` VARCHAR(16) NOT NULL,
+    `command_value` TEXT NULL,
+    `payload` TEXT NOT NULL,
+    `status` ENUM('pending', 'sending', 'sent', 'failed') NOT NULL DEFAULT 'pending',
+    `attempts` INT UNSIGNED NOT NULL DEFAULT 0,
+    `next_attempt` DATETIME NOT NULL,
+    `last_error` VARCHAR(255) NULL,
+    `claimed_by` CHAR(32) NULL,
+    `claimed_at` DATETIME NULL,
+    `created` DATETIME NOT NULL,
+    `sent` DATETIME NULL,
+    KEY `idx_outbox_due` (`status`, `next_attempt`),
+    KEY `idx_outbox_imei` (`imei`, `command_code`, `status`),
+    KEY `idx_outbox_claimed_by` (`claimed_by`)
+);
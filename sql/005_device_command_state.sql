@@ -0,0 +1,9 @@
+-- Fingerprint of the last setting value each device accepted, per command code.
+-- Miwi.send_command skips commands whose fingerprint is unchanged unless forced.
+CREATE TABLE IF NOT EXISTS `device_command_state` (
+    `imei` VARCHAR(32) NOT NULL,
+    `command_code` VARCHAR(16) NOT NULL,
+    `fingerprint` CHAR(64) NOT NULL,
+    `applied` DATETIME NOT NULL,
+    PRIMARY KEY (`imei`, `command_code`)
+);